@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+'''Compares exporting a forest tree by tree against exporting it as an
+instanced scene. Run from the repository root:
+
+    python -m benchmarks.forest [trees]
+'''
+
+from __future__ import annotations
+
+from typing import Callable, List, Tuple
+import sys
+import time
+
+from bonsai.exporters.mesh import to_instanced_mesh
+from bonsai.exporters.svg import scene_to_svg
+from bonsai.renderers import SvgBackend, render
+from bonsai.structures import Cursor, LSystem, Scene
+import bonsai.lsystems.organic as organic
+import bonsai.lsystems.traditional as traditional
+
+# weed_plant brings leaves (drawn by a render rule, and filled) into the scene
+SYSTEMS: List[Callable[[], LSystem]] = [traditional.bushy_tree, traditional.koch_island, organic.weed_plant]
+
+
+def positions(trees: int) -> List[Tuple[float, float]]:
+    return [((i % 10) * 400.0, (i // 10) * 400.0) for i in range(trees)]
+
+
+def per_tree(trees: int) -> Tuple[float, int, int]:
+    start = time.perf_counter()
+    systems = [make() for make in SYSTEMS]
+    size = 0
+    segments = 0
+    for i, (x, y) in enumerate(positions(trees)):
+        lsystem = systems[i % len(systems)]
+        commands = lsystem.expand(Cursor(x, y, 90)).commands
+        backend = SvgBackend()
+        render(backend, Cursor(x, y, 90), commands, lsystem.render_rules, lsystem.styles)
+        size += len(backend.document)
+        segments += backend.document.count("L")
+    return time.perf_counter() - start, size, segments
+
+
+def instanced(trees: int) -> Tuple[float, int, int]:
+    start = time.perf_counter()
+    systems = [make() for make in SYSTEMS]
+    scene = Scene()
+    for i, at in enumerate(positions(trees)):
+        scene.place(systems[i % len(systems)], at)
+    svg = scene_to_svg(scene)
+    segments = sum(len(prototype.segments) for prototype in scene.prototypes().values())
+    to_instanced_mesh(scene)
+    return time.perf_counter() - start, len(svg), segments
+
+
+def main() -> None:
+    trees = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    for label, run in [("per tree", per_tree), ("instanced", instanced)]:
+        elapsed, size, segments = run(trees)
+        print(f"{label:>10}: {elapsed * 1000:8.1f} ms, {size / 1024:9.1f} KiB of SVG, "
+              f"{segments} segments stored for {trees} trees")
+
+
+if __name__ == '__main__':
+    main()
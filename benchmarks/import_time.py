@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''Measures how long it takes a fresh interpreter to import bonsai.
+
+The generation-only path (structures, lsystems) should never load turtle
+or Tk; the rendering path is measured alongside it for comparison. Run
+from the repository root:
+
+    python benchmarks/import_time.py [repeats]
+'''
+
+from __future__ import annotations
+
+from typing import List, Tuple
+import statistics
+import subprocess
+import sys
+
+GENERATION_ONLY = "import bonsai.structures, bonsai.lsystems.organic, bonsai.lsystems.traditional"
+RENDERING = "import bonsai.render_2d"
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+gui = sorted(name for name in ("turtle", "tkinter", "_tkinter") if name in sys.modules)
+print(elapsed, ",".join(gui))
+'''
+
+
+def measure(imports: str, repeats: int) -> Tuple[List[float], str]:
+    timings = []
+    gui = ""
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(imports=imports)],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        elapsed, _, gui = result.stdout.strip().partition(" ")
+        timings.append(float(elapsed))
+    return timings, gui
+
+
+def main() -> None:
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for label, imports in [("generation only", GENERATION_ONLY), ("rendering", RENDERING)]:
+        try:
+            timings, gui = measure(imports, repeats)
+        except RuntimeError as ex:
+            print(f"{label:>16}: failed to import ({ex})")
+            continue
+        print(f"{label:>16}: median {statistics.median(timings) * 1000:7.2f} ms, "
+              f"min {min(timings) * 1000:7.2f} ms over {repeats} runs; "
+              f"GUI modules loaded: {gui or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
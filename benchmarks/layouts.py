@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+'''Checks that the layout tracked for each generation while expanding is
+exactly what measuring the generation again from its origin gives, both
+for `LSystem.generations` and for derivations. Run from the repository
+root:
+
+    python -m benchmarks.layouts [seeds]
+'''
+
+from __future__ import annotations
+
+from typing import Callable, List, Tuple
+import random
+import sys
+
+from bonsai.structures import Cursor, Generation, LSystem, measure
+import bonsai.lsystems.organic as organic
+import bonsai.lsystems.traditional as traditional
+
+ORIGIN = Cursor(0, -250, 90)
+
+SYSTEMS: List[Tuple[str, Callable[[], LSystem]]] = [
+    ('koch_island', traditional.koch_island),
+    ('dragon_curve', traditional.dragon_curve),
+    ('bushy_tree', traditional.bushy_tree),
+    ('flower_field', traditional.flower_field),
+    ('triangle_koch', traditional.triangle_koch),
+    ('weed_plant', organic.weed_plant),
+]
+
+
+def agrees(generation: Generation) -> bool:
+    if generation.measured is None:
+        return True  # Nothing was tracked
+    return generation.measured == measure(Cursor.from_snapshot(generation.origin), generation.commands)
+
+
+def main() -> None:
+    seeds = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    failures = 0
+    for name, make in SYSTEMS:
+        for seed in range(seeds):
+            random.seed(seed)
+            lsystem = make()
+            mismatched = [
+                generation.depth for generation in lsystem.generations(ORIGIN.clone()) if not agrees(generation)
+            ]
+            derived = lsystem.derive(ORIGIN.clone(), seed=seed).expansion.generation
+            if not agrees(derived):
+                mismatched.append(-derived.depth)
+            failures += len(mismatched)
+            print(f"{name:>14} seed {seed}: " + ("same" if not mismatched else
+                  "DIFFERENT at " + ", ".join(f"depth {d}" if d >= 0 else f"derived depth {-d}" for d in mismatched)))
+    if failures:
+        raise SystemExit(f"{failures} tracked layouts differ from a fresh measure")
+
+
+if __name__ == '__main__':
+    main()
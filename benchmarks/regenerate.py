@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''Checks that regenerating a derivation gives exactly what deriving from
+scratch does, and compares how long each takes. Run from the repository
+root:
+
+    python -m benchmarks.regenerate [start_energy]
+'''
+
+from __future__ import annotations
+
+from typing import Callable, List, Optional, Tuple
+import sys
+import time
+
+from bonsai.structures import AffectedPredicate, Branch, Cursor, Derivation, LSystem, rules_unchanged
+import bonsai.lsystems.organic as organic
+
+ORIGIN = Cursor(0, -250, 90)
+ENERGY = 1000
+SEED = 7
+
+# (label, new leaf energy, affected, new available energy)
+Case = Tuple[str, float, Optional[AffectedPredicate], Optional[float]]
+
+CASES: List[Case] = [
+    ("leaf energy 30 -> 40, every rule", 40, None, None),
+    ("leaf energy 30 -> 40, predicate", 40, lambda snapshot: 30 < snapshot.branch.energy <= 40, None),
+    ("energy 1000 -> 5000, every rule", 30, None, 5000),
+    ("energy 1000 -> 5000, rules unchanged", 30, rules_unchanged, 5000),
+]
+
+
+def flattened(derivation: Derivation) -> List[object]:
+    # Push and Pop carry no data, so only their type has to match
+    return [cmd if isinstance(cmd, Branch) else type(cmd) for cmd in derivation.expansion.commands]
+
+
+def timed(run: Callable[[], Derivation]) -> Tuple[float, Derivation]:
+    start = time.perf_counter()
+    derivation = run()
+    return time.perf_counter() - start, derivation
+
+
+def main() -> None:
+    start_energy = float(sys.argv[1]) if len(sys.argv) > 1 else 400
+    previous = organic.weed_plant(start_energy).derive(ORIGIN.clone(), available_energy=ENERGY, seed=SEED)
+    failures = 0
+    for label, leaf_energy, affected, available_energy in CASES:
+        lsystem: LSystem = organic.weed_plant(start_energy, leaf_energy)
+        energy = ENERGY if available_energy is None else available_energy
+        regen_time, regenerated = timed(lambda: lsystem.regenerate(previous, affected, available_energy))
+        fresh_time, fresh = timed(lambda: lsystem.derive(ORIGIN.clone(), available_energy=energy, seed=SEED))
+        same = (flattened(regenerated) == flattened(fresh)
+                and regenerated.expansion.layout.bounds == fresh.expansion.layout.bounds)
+        failures += 0 if same else 1
+        print(f"{label:>38}: {'same' if same else 'DIFFERENT'}, "
+              f"regenerated in {regen_time * 1000:7.1f} ms ({regenerated.rules_run} rules), "
+              f"derived in {fresh_time * 1000:7.1f} ms ({fresh.rules_run} rules)")
+    if failures:
+        raise SystemExit(f"{failures} regenerations differ from a fresh derivation")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''Statistics about trees, gathered in one streaming pass.
+
+    python -m bonsai.analytics --trees 1000 --leaf-energy 20 30 40
+
+sweeps weed_plant's leaf threshold, expanding a thousand seeded trees per
+setting across all cores and printing the aggregate statistics.'''
+
+from __future__ import annotations
+
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from math import inf
+import argparse
+import random
+
+from bonsai.structures import Bounds, Branch, BranchKind, Command, Cursor, Generation, LSystem, Pop, Push
+import bonsai.lsystems.organic as organic
+
+
+@dataclass
+class TreeStats:
+    '''Totals over one or more trees. Everything here can be merged, so
+    stats for separate trees (or separate processes) add up exactly.'''
+
+    trees: int = 0
+    commands: int = 0
+    branches: int = 0
+    kinds: Dict[BranchKind, int] = field(default_factory=dict)
+
+    # How many branches sit inside how many brackets
+    depths: Dict[int, int] = field(default_factory=dict)
+
+    total_length: float = 0
+
+    # Branch energies, bucketed: bucket i holds energies in
+    # [i * energy_bin_width, (i + 1) * energy_bin_width)
+    energy_bin_width: float = 10
+    energy_bins: Dict[int, int] = field(default_factory=dict)
+    total_energy: float = 0
+    min_energy: float = inf
+    max_energy: float = -inf
+
+    # The extents every tree reaches, each measured from its own origin
+    bounds: Bounds = field(default_factory=Bounds)
+
+    def fraction(self, kind: BranchKind) -> float:
+        return self.kinds.get(kind, 0) / self.branches if self.branches else 0
+
+    @property
+    def mean_energy(self) -> float:
+        return self.total_energy / self.branches if self.branches else 0
+
+    @property
+    def mean_length(self) -> float:
+        return self.total_length / self.branches if self.branches else 0
+
+    def merge(self, other: TreeStats) -> None:
+        if other.energy_bin_width != self.energy_bin_width:
+            raise ValueError("Can't merge stats with different energy bins")
+        self.trees += other.trees
+        self.commands += other.commands
+        self.branches += other.branches
+        _add_counts(self.kinds, other.kinds)
+        _add_counts(self.depths, other.depths)
+        self.total_length += other.total_length
+        _add_counts(self.energy_bins, other.energy_bins)
+        self.total_energy += other.total_energy
+        self.min_energy = min(self.min_energy, other.min_energy)
+        self.max_energy = max(self.max_energy, other.max_energy)
+        self.bounds.extend(other.bounds)
+
+    def summary(self) -> str:
+        per_tree = max(self.trees, 1)
+        lines = [
+            f"{self.trees} trees, {self.commands / per_tree:.1f} commands and "
+            f"{self.branches / per_tree:.1f} branches per tree",
+            f"total length {self.total_length / per_tree:.1f} per tree, {self.mean_length:.2f} per branch",
+            f"energy mean {self.mean_energy:.2f}, min {self.min_energy:.2f}, max {self.max_energy:.2f}",
+            "kinds: " + ", ".join(
+                f"{kind}: {count} ({count / max(self.branches, 1):.1%})" for kind, count in sorted(self.kinds.items())
+            ),
+            "depths: " + ", ".join(f"{depth}: {count}" for depth, count in sorted(self.depths.items())),
+            "energy: " + ", ".join(
+                f"{index * self.energy_bin_width:g}+: {count}" for index, count in sorted(self.energy_bins.items())
+            ),
+            f"extents: x {self.bounds.min_x:.1f} to {self.bounds.max_x:.1f}, "
+            f"y {self.bounds.min_y:.1f} to {self.bounds.max_y:.1f}",
+        ]
+        return "\n".join(lines)
+
+
+K = TypeVar('K', int, BranchKind)
+
+
+def _add_counts(totals: Dict[K, int], counts: Dict[K, int]) -> None:
+    for key, count in counts.items():
+        totals[key] = totals.get(key, 0) + count
+
+
+def analyze(commands: Iterable[Command],
+            t: Optional[Cursor] = None,
+            energy_bin_width: float = 10,
+            stats: Optional[TreeStats] = None) -> TreeStats:
+    '''Walks the commands once, keeping nothing but running totals and the
+    cursor. Pass `stats` to accumulate into an existing total.'''
+    if t is None:
+        t = Cursor(0, 0, 90)
+    if stats is None:
+        stats = TreeStats(energy_bin_width=energy_bin_width)
+
+    kinds: Dict[BranchKind, int] = {}
+    depths: Dict[int, int] = {}
+    energy_bins: Dict[int, int] = {}
+    bin_width = stats.energy_bin_width
+    commands_seen = 0
+    total_length = 0.0
+    total_energy = 0.0
+    min_energy, max_energy = stats.min_energy, stats.max_energy
+    bounds = Bounds()
+    bounds.include(t.pos())
+
+    state_stack = []
+    for cmd in commands:
+        commands_seen += 1
+        if isinstance(cmd, Push):
+            state_stack.append(t.snapshot())
+        elif isinstance(cmd, Pop):
+            t.restore(state_stack.pop())
+        elif isinstance(cmd, Branch):
+            kinds[cmd.kind] = kinds.get(cmd.kind, 0) + 1
+            depth = len(state_stack)
+            depths[depth] = depths.get(depth, 0) + 1
+            total_length += cmd.length
+            energy = cmd.energy
+            total_energy += energy
+            if energy < min_energy:
+                min_energy = energy
+            if energy > max_energy:
+                max_energy = energy
+            energy_bin = int(energy // bin_width)
+            energy_bins[energy_bin] = energy_bins.get(energy_bin, 0) + 1
+            t.left(cmd.angle)
+            if cmd.length != 0:
+                t.forward(cmd.length)
+                bounds.include(t.pos())
+        else:
+            raise Exception(f"Unrecognized command: {cmd}", cmd)
+
+    stats.merge(TreeStats(
+        trees=1,
+        commands=commands_seen,
+        branches=sum(kinds.values()),
+        kinds=kinds,
+        depths=depths,
+        total_length=total_length,
+        energy_bin_width=bin_width,
+        energy_bins=energy_bins,
+        total_energy=total_energy,
+        min_energy=min_energy,
+        max_energy=max_energy,
+        bounds=bounds,
+    ))
+    return stats
+
+
+def analyze_generations(generations: Iterable[Generation], energy_bin_width: float = 10) -> List[TreeStats]:
+    '''Stats for every generation as an expansion produces it (e.g. from
+    `LSystem.generations`), without holding on to any of them.'''
+    return [
+        analyze(generation.commands, Cursor.from_snapshot(generation.origin), energy_bin_width)
+        for generation in generations
+    ]
+
+
+def _analyze_seeds(make_lsystem: Callable[[], LSystem],
+                   seeds: Sequence[int],
+                   depth: Optional[int],
+                   available_energy: float,
+                   energy_bin_width: float) -> TreeStats:
+    stats = TreeStats(energy_bin_width=energy_bin_width)
+    for seed in seeds:
+        random.seed(seed)
+        lsystem = make_lsystem()
+        final = None
+        for generation in lsystem.generations(Cursor(0, 0, 90), depth, available_energy):
+            final = generation  # Earlier generations are dropped as soon as they're replaced
+        assert final is not None
+        analyze(final.commands, Cursor.from_snapshot(final.origin), stats=stats)
+    return stats
+
+
+def aggregate(make_lsystem: Callable[[], LSystem],
+              seeds: Iterable[int],
+              depth: Optional[int] = None,
+              available_energy: float = 100,
+              energy_bin_width: float = 10,
+              executor: Optional[Executor] = None,
+              chunk_size: int = 50) -> TreeStats:
+    '''Grows one tree per seed and merges their stats.
+
+    Trees are grown in chunks on the executor (a process pool by default,
+    since the rules draw from the global `random`, which threads would
+    share), and each chunk sends back a single merged total. The factory
+    has to be picklable: a module-level function, or a `partial` of one.'''
+    seeds = list(seeds)
+    chunks = [seeds[i:i + chunk_size] for i in range(0, len(seeds), chunk_size)]
+    stats = TreeStats(energy_bin_width=energy_bin_width)
+    own_executor = executor is None
+    pool = ProcessPoolExecutor() if executor is None else executor
+    try:
+        futures = [
+            pool.submit(_analyze_seeds, make_lsystem, chunk, depth, available_energy, energy_bin_width)
+            for chunk in chunks
+        ]
+        for future in futures:
+            stats.merge(future.result())
+    finally:
+        if own_executor:
+            pool.shutdown()
+    return stats
+
+
+def sweep(make_lsystem: Callable[[float], LSystem],
+          values: Iterable[float],
+          seeds: Iterable[int],
+          depth: Optional[int] = None,
+          available_energy: float = 100,
+          executor: Optional[Executor] = None) -> List[Tuple[float, TreeStats]]:
+    '''Aggregates the same seeds for every value of one parameter, which
+    `make_lsystem` takes as its only argument. All the values share one
+    pool of workers.'''
+    seeds = list(seeds)
+    own_executor = executor is None
+    pool = ProcessPoolExecutor() if executor is None else executor
+    try:
+        return [
+            (value, aggregate(partial(make_lsystem, value), seeds, depth, available_energy, executor=pool))
+            for value in values
+        ]
+    finally:
+        if own_executor:
+            pool.shutdown()
+
+
+def _weed_plant(start_energy: float, leaf_energy: float) -> LSystem:
+    return organic.weed_plant(start_energy, leaf_energy)
+
+
+DEFAULT_LEAF_ENERGIES: List[float] = [30]
+
+
+class Options(argparse.Namespace):
+    trees: int
+    start_energy: float
+    available_energy: float
+    leaf_energy: List[float]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trees', type=int, default=1000, help='how many seeded trees to grow per setting')
+    parser.add_argument('--start-energy', type=float, default=100)
+    parser.add_argument('--available-energy', type=float, default=1000)
+    parser.add_argument('--leaf-energy', type=float, nargs='+', default=DEFAULT_LEAF_ENERGIES)
+    args = parser.parse_args(namespace=Options())
+
+    make = partial(_weed_plant, args.start_energy)
+    results = sweep(make, args.leaf_energy, range(args.trees), available_energy=args.available_energy)
+    for leaf_energy, stats in results:
+        print(f"leaf_energy={leaf_energy:g}: LEAF fraction {stats.fraction(organic.LEAF):.1%}")
+        print("    " + stats.summary().replace("\n", "\n    "))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+from dataclasses import dataclass, field
+
+from bonsai.structures import DEFAULT_RESOLUTION, Matrix, Point, Scene, VertexIndex
+
+
+@dataclass
+class LineMesh:
+    # Every distinct (quantized) endpoint once, and each line as a pair of
+    # indices into them
+    vertices: List[Point] = field(default_factory=list)
+    lines: List[Tuple[int, int]] = field(default_factory=list)
+
+
+@dataclass
+class InstancedMesh:
+    '''A scene laid out the way instanced draw calls want it: one mesh per
+    prototype, in the prototype's own frame, and the list of matrices to
+    draw it with. Nested placements are already composed, so drawing each
+    mesh once per matrix reproduces the whole scene.'''
+    meshes: List[LineMesh] = field(default_factory=list)
+    matrices: List[List[Matrix]] = field(default_factory=list)
+
+    def vertex_count(self) -> int:
+        return sum(len(mesh.vertices) for mesh in self.meshes)
+
+    def instance_count(self) -> int:
+        return sum(len(matrices) for matrices in self.matrices)
+
+
+def to_instanced_mesh(scene: Scene, resolution: float = DEFAULT_RESOLUTION) -> InstancedMesh:
+    # Vertices are merged if they land in the same cell of a grid this fine
+    result = InstancedMesh()
+    prototypes = scene.prototypes()
+    for key, transforms in scene.placements().items():
+        segments = prototypes[key].segments
+        if not segments or not transforms:
+            continue  # Only places other prototypes
+        vertices = VertexIndex(resolution)
+        lines = [(vertices.index(segment.start), vertices.index(segment.end)) for segment in segments]
+        result.meshes.append(LineMesh(vertices.vertices, lines))
+        result.matrices.append([transform.matrix() for transform in transforms])
+    return result
@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+from bonsai.renderers import hex_color, path_data, shape_element
+from bonsai.structures import Bounds, BranchKind, Matrix, Primitive, Scene, Segment
+
+
+def _matrix(matrix: Matrix) -> str:
+    return "matrix({})".format(" ".join(f"{value:.4f}" for value in matrix))
+
+
+def scene_to_svg(scene: Scene, margin: float = 10) -> str:
+    # Each prototype becomes one <g> in <defs>, and every placement of it
+    # a <use>, so shared geometry appears in the file once. Everything is
+    # drawn in the scene's own (y up) coordinates inside a single flip.
+    # Strokes don't scale with their instance so every tree's lines match.
+    # A prototype's shapes go after its nested instances, so leaves end up
+    # on top of the branches around them.
+    defs: List[str] = []
+    for key, prototype in scene.prototypes().items():
+        defs.append(f'<g id="p{key}">')
+        strokes: Dict[BranchKind, List[Segment]] = {}
+        for segment in prototype.segments:
+            strokes.setdefault(segment.branch.kind, []).append(segment)
+        for kind, segments in strokes.items():
+            style = prototype.styles[kind]
+            defs.append(
+                f'<path d="{path_data(segments)}" stroke="{hex_color(style.stroke)}" '
+                f'stroke-width="{style.width}" vector-effect="non-scaling-stroke"/>'
+            )
+        for instance in prototype.instances:
+            defs.append(f'<use href="#p{instance.prototype}" transform="{_matrix(instance.transform.matrix())}"/>')
+        shapes: Dict[BranchKind, List[Primitive]] = {}
+        for primitive in prototype.primitives:
+            shapes.setdefault(primitive.kind, []).append(primitive)
+        for kind, primitives in shapes.items():
+            style = prototype.styles[kind]
+            fill = "none" if style.fill is None else hex_color(style.fill)
+            defs.append(
+                f'<g fill="{fill}" stroke="{hex_color(style.stroke)}" stroke-width="{style.width}">'
+                f'{"".join(shape_element(primitive) for primitive in primitives)}</g>'
+            )
+        defs.append('</g>')
+
+    uses = [
+        f'<use href="#p{instance.prototype}" transform="{_matrix(instance.transform.matrix())}"/>'
+        for instance in scene.instances
+    ]
+
+    box = scene.bounds()
+    if box.empty:
+        box = Bounds(0, 0, 0, 0)
+    box = box.padded(margin)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" '
+        f'viewBox="{box.min_x:.2f} {-box.max_y:.2f} {box.width:.2f} {box.height:.2f}">'
+        f'<defs>{"".join(defs)}</defs>'
+        f'<g transform="scale(1 -1)" fill="none" stroke-linecap="round">{"".join(uses)}</g>'
+        f'</svg>'
+    )
@@ -1,20 +1,25 @@
 from __future__ import annotations
 
 from typing import List
+import math
 import random
 
-from bonsai.structures import Command, Branch, Push, Pop, BranchKind, BranchSnapshot, LSystem, DEFAULT_KIND
-from bonsai.turtle_wrapper import TurtleWrapper
+from bonsai.structures import (
+    Command, Branch, Push, Pop, BranchKind, BranchSnapshot, LSystem, DEFAULT_KIND,
+    CursorSnapshot, Ellipse, Primitive, Style,
+)
 
 
-def weed_plant(start_energy: float = 100) -> LSystem:
+# The kinds of branch weed_plant grows
+START = BranchKind(1)
+BRANCH = BranchKind(2)
+LEAF = BranchKind(3)
+
+
+def weed_plant(start_energy: float = 100, leaf_energy: float = 30) -> LSystem:
     def energy_to_length(energy: float) -> int:
         return int(round(energy / 4))
 
-    START = BranchKind(1)
-    BRANCH = BranchKind(2)
-    LEAF = BranchKind(3)
-
     start_length = energy_to_length(start_energy)
 
     system = LSystem(
@@ -53,7 +58,7 @@ def weed_plant(start_energy: float = 100) -> LSystem:
 
         branch = snapshot.branch
         energy = branch.energy
-        if energy <= 30:
+        if energy <= leaf_energy:
             return [branch.clone(kind=LEAF)]
 
         if random.random() <= 0.6:
@@ -101,16 +106,16 @@ def weed_plant(start_energy: float = 100) -> LSystem:
                 ),
             ]
 
+    system.styles[LEAF] = Style(fill=(0.8, 1.0, 0.8))
+
     @system.add_render_rule(LEAF)
-    def render_leaf(t: TurtleWrapper, branch: Branch) -> None:
-        t.shape("circle")
-        t.shapesize(0.2, 1.0, 0)
-        t.fillcolor(0.8, 1.0, 0.8)
-        t.left(branch.angle)
-        t.forward(branch.length // 2)
-        t.pendown()
-        t.stamp()
-        t.penup()
+    def render_leaf(start: CursorSnapshot, branch: Branch) -> List[Primitive]:
+        # A narrow ellipse spanning the branch, centered halfway along it
+        heading = start.heading + branch.angle
+        radians = math.radians(heading)
+        x, y = start.pos
+        center = (x + branch.length / 2 * math.cos(radians), y + branch.length / 2 * math.sin(radians))
+        return [Ellipse(center, (branch.length / 2, branch.length / 10), heading, kind=LEAF)]
 
     return system
 
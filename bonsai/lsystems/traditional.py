@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import List
+from typing import Dict, List
 import random
 
 from bonsai.structures import Command, Branch, Push, Pop, BranchKind, LSystem, BranchSnapshot
@@ -12,7 +12,7 @@ def koch_island(d: int = 10) -> LSystem:
     tp = Branch(angle=90, length=0)
     tn = Branch(angle=-90, length=0)
 
-    system = LSystem([f, tn, f, tn, f, tn, f], recommended_depth=4)
+    system = LSystem([f, tn, f, tn, f, tn, f], recommended_depth=4, context_free=True)
 
     @system.add_rule(FORWARD)
     def f_replace(_: BranchSnapshot) -> List[Command]:
@@ -30,7 +30,7 @@ def dragon_curve(d: int = 10) -> LSystem:
     tp = Branch(angle=90, length=0)
     tn = Branch(angle=-90, length=0)
 
-    system = LSystem([f1], recommended_depth=10)
+    system = LSystem([f1], recommended_depth=10, context_free=True)
 
     @system.add_rule(T1)
     def f1_replace(_: BranchSnapshot) -> List[Command]:
@@ -52,7 +52,7 @@ def bushy_tree(d: int = 10) -> LSystem:
     push = Push()
     pop = Pop()
 
-    system = LSystem([f], recommended_depth=4)
+    system = LSystem([f], recommended_depth=4, context_free=True)
 
     @system.add_rule(FORWARD)
     def f_replace(_: BranchSnapshot) -> List[Command]:
@@ -94,10 +94,14 @@ def triangle_koch(d: int = 400) -> LSystem:
     FORWARD = BranchKind(1)
     tp = Branch(angle=86, length=0)
     tn = Branch(angle=-86, length=0)
+    # One branch per length, so that equal segments are shared in the rope
+    forwards: Dict[float, Branch] = {}
     def forward(d: float) -> Branch:
-        return Branch(angle=0, length=d, kind=FORWARD)
+        if d not in forwards:
+            forwards[d] = Branch(angle=0, length=d, kind=FORWARD)
+        return forwards[d]
 
-    system = LSystem([forward(d)], recommended_depth=4)
+    system = LSystem([forward(d)], recommended_depth=4, context_free=True)
 
     @system.add_rule(FORWARD)
     def f_replace(snapshot: BranchSnapshot) -> List[Command]:
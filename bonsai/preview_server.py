@@ -0,0 +1,169 @@
+'''A local HTTP server that previews lsystems as they expand.
+
+    python -m bonsai.preview_server --port 8000
+
+then open http://localhost:8000/?system=koch_island&depth=4. The page
+subscribes to /generations, which streams one SVG per generation as a
+server-sent event. A new subscription supersedes the one in progress.'''
+
+from __future__ import annotations
+
+from typing import Callable, Dict, Optional
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+import argparse
+import asyncio
+import html
+
+from bonsai.renderers import SvgBackend, render
+from bonsai.service import GenerationService
+from bonsai.structures import Budget, Cursor, Generation, LSystem
+import bonsai.lsystems.organic as organic
+import bonsai.lsystems.traditional as traditional
+
+
+SYSTEMS: Dict[str, Callable[[], LSystem]] = {
+    'koch_island': traditional.koch_island,
+    'dragon_curve': traditional.dragon_curve,
+    'bushy_tree': traditional.bushy_tree,
+    'flower_field': traditional.flower_field,
+    'triangle_koch': traditional.triangle_koch,
+    'weed_plant': organic.weed_plant,
+}
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head><title>bonsai preview</title></head>
+<body>
+<p id="status">Connecting...</p>
+<div id="tree" style="width: 90vw; height: 85vh"></div>
+<script>
+const events = new EventSource("/generations" + window.location.search);
+events.onmessage = (event) => {{
+    const separator = event.data.indexOf(" ");
+    document.getElementById("status").textContent =
+        "{name}: generation " + event.data.slice(0, separator);
+    document.getElementById("tree").innerHTML = event.data.slice(separator + 1);
+    document.querySelector("#tree svg").setAttribute("style", "width: 100%; height: 100%");
+}};
+events.onerror = () => {{
+    events.close();
+    document.getElementById("status").textContent += " (done)";
+}};
+</script>
+</body>
+</html>
+'''
+
+
+# Systems that never run into the budget (weed_plant, say) would otherwise
+# expand for as long as a client asks them to
+MAX_DEPTH = 12
+
+
+class PreviewServer:
+    def __init__(self, service: Optional[GenerationService] = None, max_depth: int = MAX_DEPTH) -> None:
+        self.service = GenerationService() if service is None else service
+        self.max_depth = max_depth
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            while (await reader.readline()).strip():
+                pass  # Headers are of no interest
+            if len(request_line) < 2 or request_line[0] != 'GET':
+                await self.respond(writer, 405, 'text/plain', 'Only GET is supported\n')
+                return
+
+            url = urlsplit(request_line[1])
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            name = query.get('system', 'koch_island')
+            if name not in SYSTEMS:
+                await self.respond(writer, 404, 'text/plain', f'Unknown system {name!r}\n')
+            elif url.path == '/':
+                await self.respond(writer, 200, 'text/html', PAGE.format(name=html.escape(name)))
+            elif url.path == '/generations':
+                try:
+                    depth = int(query['depth']) if 'depth' in query else None
+                    energy = float(query.get('energy', 100))
+                    if depth is not None and depth < 0:
+                        raise ValueError(f"depth must not be negative: {depth}")
+                    if depth is not None and depth > self.max_depth:
+                        raise ValueError(f"depth must be at most {self.max_depth}: {depth}")
+                except ValueError as ex:
+                    await self.respond(writer, 400, 'text/plain', f'Bad parameter: {ex}\n')
+                    return
+                lsystem = SYSTEMS[name]()
+                if depth is None:
+                    depth = min(lsystem.recommended_depth, self.max_depth)
+                await self.stream(writer, lsystem, depth, energy)
+            else:
+                await self.respond(writer, 404, 'text/plain', 'Not found\n')
+        except ConnectionError:
+            pass  # The client went away
+        finally:
+            writer.close()
+
+    async def respond(self, writer: asyncio.StreamWriter, status: int, content_type: str, body: str) -> None:
+        data = body.encode('utf-8')
+        writer.write(
+            f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+            f'Content-Type: {content_type}; charset=utf-8\r\n'
+            f'Content-Length: {len(data)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + data
+        )
+        await writer.drain()
+
+    async def stream(self, writer: asyncio.StreamWriter, lsystem: LSystem, depth: Optional[int], energy: float) -> None:
+        writer.write(
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: text/event-stream\r\n'
+            b'Cache-Control: no-cache\r\n'
+            b'Connection: close\r\n\r\n'
+        )
+        await writer.drain()
+        loop = asyncio.get_running_loop()
+        async for generation in self.service.stream(lsystem, Cursor(0, 0, 90), depth, energy):
+            # Tracing a deep generation takes a while; keep it off the loop too
+            svg = await loop.run_in_executor(self.service.executor, render_svg, lsystem, generation)
+            writer.write(f'data: {generation.depth} {svg}\n\n'.encode('utf-8'))
+            await writer.drain()
+
+
+def render_svg(lsystem: LSystem, generation: Generation) -> str:
+    # The bounds are measured while rendering, since they have to take in
+    # whatever the render rules draw around the branches
+    backend = SvgBackend()
+    render(backend, Cursor.from_snapshot(generation.origin), generation.commands, lsystem.render_rules, lsystem.styles)
+    return backend.document
+
+
+async def serve(host: str, port: int, max_commands: int, max_depth: int) -> None:
+    service = GenerationService(budget=Budget(max_commands=max_commands))
+    server = await asyncio.start_server(PreviewServer(service, max_depth).handle, host, port)
+    print(f"Serving previews on http://{host}:{port}/?system=koch_island&depth=4")
+    async with server:
+        await server.serve_forever()
+
+
+class Options(argparse.Namespace):
+    host: str
+    port: int
+    max_commands: int
+    max_depth: int
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-commands', type=int, default=1_000_000,
+                        help='stop expanding before any generation grows past this many commands')
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH,
+                        help='refuse requests for more generations than this')
+    args = parser.parse_args(namespace=Options())
+    asyncio.run(serve(args.host, args.port, args.max_commands, args.max_depth))
+
+
+if __name__ == '__main__':
+    main()
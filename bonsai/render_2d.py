@@ -1,37 +1,114 @@
 from __future__ import annotations
 
-from typing import List, Dict, Optional
+from typing import Callable, Iterable, Dict, Optional, Tuple
+import asyncio
+import queue
+import threading
 import turtle
 
-from bonsai.structures import Command, Branch, BranchRenderer, BranchKind, interpret
-from bonsai.turtle_wrapper import TurtleWrapper, TurtleSnapshot
+from bonsai.renderers.base import Backend, render
+from bonsai.renderers.canvas import CanvasBackend
+from bonsai.service import GenerationService
+from bonsai.structures import (
+    AngleGrid, Command, BranchRenderer, BranchKind, Bounds, Cursor, CursorSnapshot, Generation, LSystem, Style,
+)
+from bonsai.turtle_wrapper import TurtleWrapper
+
+
+def window_backend(margin: float = 20) -> CanvasBackend:
+    '''Draws straight onto the turtle window's canvas, which is centered on
+    the origin, fitting the drawing to the visible part of it.'''
+    width, height = turtle.window_width(), turtle.window_height()
+    return CanvasBackend(turtle.getcanvas(), width, height, (-width / 2, -height / 2), margin)
+
+
+def draw(t: TurtleWrapper,
+         commands: Iterable[Command],
+         render_rules: Optional[Dict[BranchKind, BranchRenderer]] = None,
+         styles: Optional[Dict[BranchKind, Style]] = None,
+         backend: Optional[Backend] = None,
+         bounds: Optional[Bounds] = None,
+         grid: Optional[AngleGrid] = None) -> Backend:
+    # Walking on the grid the commands were expanded on (a generation's
+    # `origin.grid`) puts every line exactly where expansion measured it
+    if backend is None:
+        backend = window_backend()
+    start = CursorSnapshot(t.position(), t.heading(), grid)
+    render(backend, Cursor.from_snapshot(start), commands, render_rules, styles, bounds)
+    return backend
 
 
 def draw_and_wait(t: TurtleWrapper,
-                  commands: List[Command],
-                  render_rules: Optional[Dict[BranchKind, BranchRenderer]] = None) -> None:
-    if render_rules is None:
-        render_rules = {}
-
-    renderer = t.clone()
-
-    def render(snapshot: TurtleSnapshot, branch: Branch) -> List[Command]:
-        renderer.restore(snapshot)
-        if branch.kind in render_rules:
-            render_rules[branch.kind](renderer, branch)
-        else:
-            renderer.pendown()
-            renderer.left(branch.angle)
-            renderer.forward(branch.length)
-            renderer.penup()
-        return [branch]
-
+                  commands: Iterable[Command],
+                  render_rules: Optional[Dict[BranchKind, BranchRenderer]] = None,
+                  styles: Optional[Dict[BranchKind, Style]] = None,
+                  bounds: Optional[Bounds] = None,
+                  grid: Optional[AngleGrid] = None) -> None:
     turtle.tracer(0)
-    t.pendown()
-    interpret(t, commands, render)
+    draw(t, commands, render_rules, styles, bounds=bounds, grid=grid)
     turtle.update()
     turtle.mainloop()
 
+
+def draw_progressively(t: TurtleWrapper,
+                       make_lsystem: Callable[[], LSystem],
+                       depth: Optional[int] = None,
+                       available_energy: float = 100,
+                       poll_interval: int = 50) -> None:
+    '''Expands in the background and redraws as each deeper generation
+    arrives, keeping the window responsive. Clicking the window starts over
+    with a fresh lsystem, abandoning the expansion in progress.'''
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    service = GenerationService()
+
+    results: queue.Queue[Tuple[int, LSystem, Generation]] = queue.Queue()
+    request_id = 0
+
+    def request() -> None:
+        nonlocal request_id
+        request_id += 1
+        current_id = request_id
+        lsystem = make_lsystem()
+
+        def on_generation(generation: Generation) -> None:
+            results.put((current_id, lsystem, generation))
+
+        loop.call_soon_threadsafe(
+            service.submit,
+            lsystem,
+            Cursor.from_snapshot(t.snapshot()),
+            on_generation,
+            depth,
+            available_energy,
+        )
+
+    def poll() -> None:
+        latest = None
+        while True:
+            try:
+                latest = results.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None and latest[0] == request_id:
+            _, lsystem, generation = latest
+            backend = window_backend()
+            backend.clear()
+            draw(t, generation.commands, lsystem.render_rules, lsystem.styles, backend, generation.bounds,
+                 generation.origin.grid)
+        turtle.ontimer(poll, poll_interval)
+
+    def on_click(x: float, y: float) -> None:
+        request()
+
+    turtle.tracer(0)
+    turtle.onscreenclick(on_click)
+    request()
+    poll()
+    turtle.mainloop()
+    loop.call_soon_threadsafe(service.cancel)
+    loop.call_soon_threadsafe(loop.stop)
+
 '''
 
 
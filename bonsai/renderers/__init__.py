@@ -0,0 +1,6 @@
+from __future__ import annotations
+
+# The Tk canvas and NumPy raster backends live in their own modules, so
+# importing this package needs neither.
+from .base import Backend, Viewport, render, render_scene, hex_color
+from .svg import SvgBackend, path_data, shape_element
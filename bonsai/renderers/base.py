@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Protocol, Sequence, Tuple
+from dataclasses import dataclass
+
+from bonsai.structures import (
+    Bounds, Branch, BranchKind, BranchRenderer, Color, Command, Cursor, Point, Pop, Primitive, Push, Scene, Segment,
+    Style,
+)
+
+
+class Backend(Protocol):
+    '''Something that can draw a tree, handed to it in batches: every
+    stroke of one kind at once, then every shape of one kind at once.'''
+
+    def begin(self, bounds: Bounds) -> None:
+        '''Called first, with the bounds of everything that will be drawn.'''
+
+    def draw_segments(self, segments: Sequence[Segment], style: Style) -> None: ...
+
+    def draw_primitives(self, primitives: Sequence[Primitive], style: Style) -> None: ...
+
+    def finish(self) -> None: ...
+
+
+def hex_color(color: Color) -> str:
+    return "#" + "".join(f"{round(max(0, min(channel, 1)) * 255):02x}" for channel in color)
+
+
+@dataclass
+class Viewport:
+    '''Maps world coordinates (y up) onto a device (y down).'''
+    scale: float
+    offset_x: float
+    offset_y: float
+
+    @staticmethod
+    def fit(bounds: Bounds, width: float, height: float, margin: float = 0, origin: Point = (0, 0)) -> Viewport:
+        '''Centers the bounds in the width x height area whose top left
+        corner is at `origin` on the device.'''
+        scale, (dx, dy) = bounds.fit(width, height, margin)
+        return Viewport(scale, origin[0] + width / 2 + dx, origin[1] + height / 2 - dy)
+
+    def to_device(self, pos: Point) -> Point:
+        return (pos[0] * self.scale + self.offset_x, self.offset_y - pos[1] * self.scale)
+
+
+def render(backend: Backend,
+           t: Cursor,
+           commands: Iterable[Command],
+           render_rules: Optional[Dict[BranchKind, BranchRenderer]] = None,
+           styles: Optional[Dict[BranchKind, Style]] = None,
+           bounds: Optional[Bounds] = None) -> None:
+    '''Walks the commands once, gathering every stroke and every shape the
+    render rules ask for by kind, then hands them to the backend in batches.
+    Strokes are all drawn before shapes, so shapes (like leaves) end up on
+    top of the branches. If the bounds aren't given they're measured from
+    what gets drawn.'''
+    if render_rules is None:
+        render_rules = {}
+    if styles is None:
+        styles = {}
+
+    segments: Dict[BranchKind, List[Segment]] = {}
+    primitives: Dict[BranchKind, List[Primitive]] = {}
+    state_stack = []
+    for cmd in commands:
+        if isinstance(cmd, Push):
+            state_stack.append(t.snapshot())
+        elif isinstance(cmd, Pop):
+            t.restore(state_stack.pop())
+        elif isinstance(cmd, Branch):
+            if cmd.kind in render_rules:
+                for primitive in render_rules[cmd.kind](t.snapshot(), cmd):
+                    primitives.setdefault(primitive.kind, []).append(primitive)
+            t.left(cmd.angle)
+            if cmd.length != 0:
+                start = t.pos()
+                t.forward(cmd.length)
+                segments.setdefault(cmd.kind, []).append(Segment(start, t.pos(), cmd))
+        else:
+            raise Exception(f"Unrecognized command: {cmd}", cmd)
+
+    if bounds is None:
+        bounds = Bounds()
+        for batch in segments.values():
+            for segment in batch:
+                bounds.include(segment.start)
+                bounds.include(segment.end)
+        for shapes in primitives.values():
+            for primitive in shapes:
+                bounds.extend(primitive.bounds())
+
+    default = Style()
+    _draw_batches(
+        backend,
+        bounds,
+        [(styles.get(kind, default), batch) for kind, batch in segments.items()],
+        [(styles.get(kind, default), shapes) for kind, shapes in primitives.items()],
+    )
+
+
+def render_scene(backend: Backend, scene: Scene) -> None:
+    '''Draws every tree in the scene with the styles it was added with.
+    Backends can't instance, so every placement of a prototype is drawn
+    out in full, batched by style.'''
+    segments: Dict[Style, List[Segment]] = {}
+    primitives: Dict[Style, List[Primitive]] = {}
+    prototypes = scene.prototypes()
+    for key, transforms in scene.placements().items():
+        prototype = prototypes[key]
+        for transform in transforms:
+            for segment in prototype.segments:
+                segments.setdefault(prototype.styles[segment.branch.kind], []).append(
+                    Segment(transform.apply(segment.start), transform.apply(segment.end), segment.branch)
+                )
+            for primitive in prototype.primitives:
+                primitives.setdefault(prototype.styles[primitive.kind], []).append(
+                    transform.transform_primitive(primitive)
+                )
+    _draw_batches(backend, scene.bounds(), list(segments.items()), list(primitives.items()))
+
+
+def _draw_batches(backend: Backend,
+                  bounds: Bounds,
+                  segments: Sequence[Tuple[Style, Sequence[Segment]]],
+                  primitives: Sequence[Tuple[Style, Sequence[Primitive]]]) -> None:
+    backend.begin(bounds)
+    for style, batch in segments:
+        backend.draw_segments(batch, style)
+    for style, shapes in primitives:
+        backend.draw_primitives(shapes, style)
+    backend.finish()
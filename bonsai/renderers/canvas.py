@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from typing import List, Optional, Sequence
+import tkinter
+
+from bonsai.structures import Bounds, Point, Primitive, Segment, Style
+from .base import Viewport, hex_color
+
+
+class CanvasBackend:
+    '''Draws straight onto a tkinter Canvas, without going through turtle.
+
+    Strokes that follow on from each other are joined into one polyline,
+    so a batch costs one canvas item per unbroken run rather than one per
+    branch. Everything drawn is tagged, so `clear` removes exactly that.
+
+    The drawing is fit into the width x height area whose top left corner
+    is at `origin` in canvas coordinates; by default, the whole canvas.'''
+
+    def __init__(self, canvas: tkinter.Canvas,
+                       width: Optional[float] = None,
+                       height: Optional[float] = None,
+                       origin: Point = (0, 0),
+                       margin: float = 20,
+                       tag: str = "bonsai") -> None:
+        self.canvas = canvas
+        self.width = width
+        self.height = height
+        self.origin = origin
+        self.margin = margin
+        self.tag = tag
+        self.viewport = Viewport(1, 0, 0)
+
+    def clear(self) -> None:
+        self.canvas.delete(self.tag)
+
+    def begin(self, bounds: Bounds) -> None:
+        width = self.canvas.winfo_width() if self.width is None else self.width
+        height = self.canvas.winfo_height() if self.height is None else self.height
+        self.viewport = Viewport.fit(bounds, width, height, self.margin, self.origin)
+
+    def draw_segments(self, segments: Sequence[Segment], style: Style) -> None:
+        to_device = self.viewport.to_device
+        color = hex_color(style.stroke)
+        run: List[float] = []
+        last = None
+        for segment in segments:
+            if segment.start != last:
+                self._line(run, color, style.width)
+                run = list(to_device(segment.start))
+            run.extend(to_device(segment.end))
+            last = segment.end
+        self._line(run, color, style.width)
+
+    def draw_primitives(self, primitives: Sequence[Primitive], style: Style) -> None:
+        to_device = self.viewport.to_device
+        fill = "" if style.fill is None else hex_color(style.fill)
+        outline = hex_color(style.stroke)
+        for primitive in primitives:
+            coordinates = [value for point in primitive.outline() for value in to_device(point)]
+            self.canvas.create_polygon(
+                coordinates, fill=fill, outline=outline, width=style.width, tags=self.tag,
+            )
+
+    def finish(self) -> None:
+        self.canvas.update_idletasks()
+
+    def _line(self, coordinates: List[float], color: str, width: float) -> None:
+        if len(coordinates) >= 4:
+            self.canvas.create_line(
+                coordinates, fill=color, width=width, capstyle=tkinter.ROUND, joinstyle=tkinter.ROUND, tags=self.tag,
+            )
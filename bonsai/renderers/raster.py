@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import numpy.typing as npt
+
+from bonsai.structures import Bounds, Color, Point, Primitive, Segment, Style
+from .base import Viewport
+
+Floats = npt.NDArray[np.float64]
+Bytes = npt.NDArray[np.uint8]
+
+
+class RasterBackend:
+    '''Draws into an RGB image held in a NumPy array, with no window at all.
+
+    Each batch is rasterized in one go: every stroke is sampled at (at
+    least) one point per pixel along its length, and all the samples are
+    written with a single fancy-indexing assignment. Shapes are filled a
+    batch at a time too, one scanline per shape per row they cover.'''
+
+    def __init__(self, width: int,
+                       height: int,
+                       background: Color = (1.0, 1.0, 1.0),
+                       margin: float = 10) -> None:
+        self.width = width
+        self.height = height
+        self.background = background
+        self.margin = margin
+        self.image = np.empty((height, width, 3), dtype=np.uint8)
+        self.image[:, :] = _to_bytes(background)
+        self.viewport = Viewport(1, 0, 0)
+
+    def begin(self, bounds: Bounds) -> None:
+        self.image[:, :] = _to_bytes(self.background)
+        self.viewport = Viewport.fit(bounds, self.width, self.height, self.margin)
+
+    def draw_segments(self, segments: Sequence[Segment], style: Style) -> None:
+        if not segments:
+            return
+        ends = np.array([(*segment.start, *segment.end) for segment in segments], dtype=np.float64)
+        x0, y0 = self._to_device(ends[:, 0], ends[:, 1])
+        x1, y1 = self._to_device(ends[:, 2], ends[:, 3])
+        self._stroke(x0, y0, x1, y1, style)
+
+    def draw_primitives(self, primitives: Sequence[Primitive], style: Style) -> None:
+        # Outlines with the same number of points are stacked into one array
+        by_size: Dict[int, List[List[Point]]] = {}
+        for primitive in primitives:
+            outline = primitive.outline()
+            by_size.setdefault(len(outline), []).append(outline)
+        for outlines in by_size.values():
+            points = np.array(outlines, dtype=np.float64)
+            xs, ys = self._to_device(points[:, :, 0], points[:, :, 1])
+            if style.fill is not None:
+                self._fill(xs, ys, _to_bytes(style.fill))
+            self._stroke(xs.ravel(), ys.ravel(), np.roll(xs, -1, axis=1).ravel(), np.roll(ys, -1, axis=1).ravel(), style)
+
+    def finish(self) -> None:
+        pass
+
+    def save_ppm(self, path: str) -> None:
+        '''Writes the image as a binary PPM, which needs nothing but NumPy.'''
+        with open(path, 'wb') as f:
+            f.write(f"P6 {self.width} {self.height} 255\n".encode('ascii'))
+            f.write(self.image.tobytes())
+
+    def _to_device(self, xs: Floats, ys: Floats) -> Tuple[Floats, Floats]:
+        viewport = self.viewport
+        return (xs * viewport.scale + viewport.offset_x, viewport.offset_y - ys * viewport.scale)
+
+    def _stroke(self, x0: Floats, y0: Floats, x1: Floats, y1: Floats, style: Style) -> None:
+        dx, dy = x1 - x0, y1 - y0
+        samples = np.ceil(np.hypot(dx, dy)).astype(np.intp) + 1
+        which = np.repeat(np.arange(len(samples)), samples)
+        firsts = np.cumsum(samples) - samples
+        steps = (np.arange(len(which)) - firsts[which]) / np.maximum(samples - 1, 1)[which]
+        xs = x0[which] + dx[which] * steps
+        ys = y0[which] + dy[which] * steps
+
+        color = _to_bytes(style.stroke)
+        radius = max(int(round((style.width - 1) / 2)), 0)
+        for ox in range(-radius, radius + 1):
+            for oy in range(-radius, radius + 1):
+                self._plot(xs + ox, ys + oy, color)
+
+    def _plot(self, xs: Floats, ys: Floats, color: Bytes) -> None:
+        columns = np.rint(xs).astype(np.intp)
+        rows = np.rint(ys).astype(np.intp)
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        self.image[rows[inside], columns[inside]] = color
+
+    def _fill(self, xs: Floats, ys: Floats, color: Bytes) -> None:
+        # One row per polygon per pixel row it covers. Each row finds where
+        # it crosses the polygon's edges, and (by the even-odd rule) fills
+        # between the first and second crossing, the third and fourth...
+        top = np.clip(np.ceil(ys.min(axis=1)), 0, self.height).astype(np.intp)
+        bottom = np.clip(np.floor(ys.max(axis=1)), -1, self.height - 1).astype(np.intp)
+        counts = np.maximum(bottom - top + 1, 0)
+        which = np.repeat(np.arange(len(counts)), counts)
+        rows = (np.arange(len(which)) - (np.cumsum(counts) - counts)[which] + top[which]).astype(np.float64)
+
+        ax, ay = xs[which], ys[which]
+        bx, by = np.roll(ax, -1, axis=1), np.roll(ay, -1, axis=1)
+        y = rows[:, np.newaxis]
+        straddles = (ay > y) != (by > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossings = np.where(straddles, ax + (y - ay) * (bx - ax) / (by - ay), np.inf)
+        crossings.sort(axis=1)
+        pairs = crossings.shape[1] // 2 * 2
+        starts, ends = crossings[:, 0:pairs:2], crossings[:, 1:pairs:2]
+        spans = np.isfinite(ends)
+
+        span_rows = np.broadcast_to(rows[:, np.newaxis], spans.shape)[spans].astype(np.intp)
+        lefts = np.clip(np.ceil(starts[spans]), 0, self.width).astype(np.intp)
+        rights = np.clip(np.floor(ends[spans]), -1, self.width - 1).astype(np.intp)
+        lengths = np.maximum(rights - lefts + 1, 0)
+        pixel_rows = np.repeat(span_rows, lengths)
+        firsts = np.cumsum(lengths) - lengths
+        columns = np.arange(len(pixel_rows)) - np.repeat(firsts, lengths) + np.repeat(lefts, lengths)
+        self.image[pixel_rows, columns] = color
+
+
+def _to_bytes(color: Color) -> Bytes:
+    return np.array([round(max(0, min(channel, 1)) * 255) for channel in color], dtype=np.uint8)
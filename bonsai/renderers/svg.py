@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from typing import Iterable, List, Sequence
+
+from bonsai.structures import Bounds, Ellipse, Primitive, Segment, Style
+from .base import hex_color
+
+
+def path_data(segments: Iterable[Segment]) -> str:
+    '''The `d` attribute of a path through the segments, only moving the
+    pen where one doesn't start at the end of the last.'''
+    path: List[str] = []
+    last = None
+    for segment in segments:
+        (x0, y0), (x1, y1) = segment.start, segment.end
+        if segment.start != last:
+            path.append(f"M{x0:.2f} {y0:.2f}")
+        path.append(f"L{x1:.2f} {y1:.2f}")
+        last = segment.end
+    return "".join(path)
+
+
+def shape_element(primitive: Primitive) -> str:
+    '''An <ellipse> or <polygon> for the primitive, left to inherit its
+    fill and stroke.'''
+    if isinstance(primitive, Ellipse):
+        (cx, cy), (rx, ry) = primitive.center, primitive.radii
+        return (
+            f'<ellipse rx="{rx:.2f}" ry="{ry:.2f}" '
+            f'transform="translate({cx:.2f} {cy:.2f}) rotate({primitive.rotation:.2f})"/>'
+        )
+    points = " ".join(f"{x:.2f},{y:.2f}" for x, y in primitive.points)
+    return f'<polygon points="{points}"/>'
+
+
+class SvgBackend:
+    '''Builds an SVG document in world coordinates: one <path> per batch of
+    strokes, and one <g> per batch of shapes, flipped so y points up.'''
+
+    def __init__(self, margin: float = 10) -> None:
+        self.margin = margin
+        self.parts: List[str] = []
+        self.bounds = Bounds()
+        self.document = ""
+
+    def begin(self, bounds: Bounds) -> None:
+        self.parts = []
+        self.bounds = bounds
+        self.document = ""
+
+    def draw_segments(self, segments: Sequence[Segment], style: Style) -> None:
+        self.parts.append(
+            f'<path d="{path_data(segments)}" fill="none" stroke="{hex_color(style.stroke)}" '
+            f'stroke-width="{style.width}" stroke-linecap="round"/>'
+        )
+
+    def draw_primitives(self, primitives: Sequence[Primitive], style: Style) -> None:
+        fill = "none" if style.fill is None else hex_color(style.fill)
+        shapes = "".join(shape_element(primitive) for primitive in primitives)
+        self.parts.append(
+            f'<g fill="{fill}" stroke="{hex_color(style.stroke)}" stroke-width="{style.width}">{shapes}</g>'
+        )
+
+    def finish(self) -> None:
+        box = self.bounds if not self.bounds.empty else Bounds(0, 0, 0, 0)
+        box = box.padded(self.margin)
+        self.document = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" '
+            f'viewBox="{box.min_x:.2f} {-box.max_y:.2f} {box.width:.2f} {box.height:.2f}">'
+            f'<g transform="scale(1 -1)">{"".join(self.parts)}</g>'
+            f'</svg>'
+        )
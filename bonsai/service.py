@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import AsyncIterator, Callable, Iterator, Optional
+from concurrent.futures import Executor
+import asyncio
+
+from bonsai.structures import Budget, Cursor, Generation, LSystem
+
+
+def _advance(steps: Iterator[Generation]) -> Optional[Generation]:
+    return next(steps, None)
+
+
+async def generate(lsystem: LSystem,
+                   t: Cursor,
+                   depth: Optional[int] = None,
+                   available_energy: float = 100,
+                   executor: Optional[Executor] = None,
+                   budget: Optional[Budget] = None,
+                   ) -> AsyncIterator[Generation]:
+    '''Expands the lsystem in an executor, yielding each generation as it
+    completes so the event loop stays free in between.'''
+    loop = asyncio.get_running_loop()
+    steps = lsystem.generations(t, depth, available_energy, budget)
+    while True:
+        generation = await loop.run_in_executor(executor, _advance, steps)
+        if generation is None:
+            return
+        yield generation
+
+
+class GenerationService:
+    '''Runs one expansion at a time: starting a new one supersedes the
+    previous, which stops at its next generation boundary.
+
+    A step that is already running in the executor can't be interrupted,
+    but its result is discarded and no further steps are scheduled.'''
+
+    def __init__(self, executor: Optional[Executor] = None, budget: Optional[Budget] = None) -> None:
+        self.executor = executor
+
+        # Applied to every request, so one bad parameter can't exhaust memory
+        self.budget = budget
+
+        self.superseded: Optional[asyncio.Event] = None
+        self.current: Optional[asyncio.Task[None]] = None
+
+    def cancel(self) -> None:
+        self._supersede()
+        if self.current is not None:
+            self.current.cancel()
+            self.current = None
+
+    def _supersede(self) -> None:
+        if self.superseded is not None:
+            self.superseded.set()
+            self.superseded = None
+
+    async def stream(self,
+                     lsystem: LSystem,
+                     t: Cursor,
+                     depth: Optional[int] = None,
+                     available_energy: float = 100,
+                     ) -> AsyncIterator[Generation]:
+        self._supersede()
+        superseded = asyncio.Event()
+        self.superseded = superseded
+
+        generations = generate(lsystem, t, depth, available_energy, self.executor, self.budget)
+        try:
+            while not superseded.is_set():
+                step = asyncio.ensure_future(generations.__anext__())
+                waiter = asyncio.ensure_future(superseded.wait())
+                await asyncio.wait({step, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if superseded.is_set():
+                    step.cancel()
+                    return
+                try:
+                    yield step.result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            if self.superseded is superseded:
+                self.superseded = None
+
+    def submit(self,
+               lsystem: LSystem,
+               t: Cursor,
+               on_generation: Callable[[Generation], None],
+               depth: Optional[int] = None,
+               available_energy: float = 100,
+               ) -> asyncio.Task[None]:
+        '''Like `stream`, but delivers generations to a callback from a
+        task. Must be called from the thread running the event loop.'''
+        async def run() -> None:
+            async for generation in self.stream(lsystem, t, depth, available_energy):
+                on_generation(generation)
+
+        self.cancel()
+        task = asyncio.ensure_future(run())
+        self.current = task
+        return task
@@ -1,5 +1,13 @@
 from __future__ import annotations
 
 from .branch import BranchGraph, Command, Push, Pop, Branch, BranchId, BranchKind, DEFAULT_KIND
-from .interpreter import interpret, naive_interpret
-from .lsystem import LSystem, BranchSnapshot, BranchTransformer, BranchRenderer
+from .cursor import Cursor, CursorSnapshot
+from .budget import Budget, BudgetExceeded, BudgetOutcome, BudgetPolicy
+from .bounds import Bounds, BoundsTracker, Layout, SubtreeBounds, Point, tile
+from .primitives import Color, Style, Ellipse, Polygon, Primitive
+from .interpreter import interpret, naive_interpret, measure, trace, Segment
+from .grid import AngleGrid, GridCursor, VertexIndex, VertexKey, quantize, is_closed, DEFAULT_RESOLUTION
+from .lsystem import LSystem, BranchSnapshot, BranchTransformer, BranchRenderer, Generation, Expansion
+from .rope import CommandRope, IdentityMemo, RopeLeaf, RopeConcat, RopeBuilder, as_rope, concat
+from .derivation import Derivation, DerivationStep, AffectedPredicate, rules_unchanged
+from .scene import Scene, Transform, Instance, Prototype, Matrix
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+from dataclasses import dataclass, field
+from math import inf
+
+from .branch import Command
+
+Point = Tuple[float, float]
+
+
+@dataclass
+class Bounds:
+    min_x: float = inf
+    min_y: float = inf
+    max_x: float = -inf
+    max_y: float = -inf
+
+    @property
+    def empty(self) -> bool:
+        return self.min_x > self.max_x
+
+    @property
+    def width(self) -> float:
+        return 0 if self.empty else self.max_x - self.min_x
+
+    @property
+    def height(self) -> float:
+        return 0 if self.empty else self.max_y - self.min_y
+
+    @property
+    def center(self) -> Point:
+        if self.empty:
+            return (0, 0)
+        return ((self.min_x + self.max_x) / 2, (self.min_y + self.max_y) / 2)
+
+    def include(self, pos: Point) -> None:
+        x, y = pos
+        if x < self.min_x:
+            self.min_x = x
+        if x > self.max_x:
+            self.max_x = x
+        if y < self.min_y:
+            self.min_y = y
+        if y > self.max_y:
+            self.max_y = y
+
+    def extend(self, other: Bounds) -> None:
+        if not other.empty:
+            self.include((other.min_x, other.min_y))
+            self.include((other.max_x, other.max_y))
+
+    def intersects(self, other: Bounds) -> bool:
+        return (not self.empty and not other.empty
+                and self.min_x <= other.max_x and other.min_x <= self.max_x
+                and self.min_y <= other.max_y and other.min_y <= self.max_y)
+
+    def translated(self, dx: float, dy: float) -> Bounds:
+        if self.empty:
+            return Bounds()
+        return Bounds(self.min_x + dx, self.min_y + dy, self.max_x + dx, self.max_y + dy)
+
+    def padded(self, margin: float) -> Bounds:
+        if self.empty:
+            return Bounds()
+        return Bounds(self.min_x - margin, self.min_y - margin, self.max_x + margin, self.max_y + margin)
+
+    def fit(self, width: float, height: float, margin: float = 0) -> Tuple[float, Point]:
+        '''The uniform scale and the offset (applied after scaling) that
+        center these bounds in a width x height box centered on the origin.'''
+        if self.empty:
+            return (1.0, (0, 0))
+        available_w = max(width - 2 * margin, 1)
+        available_h = max(height - 2 * margin, 1)
+        scale = min(available_w / max(self.width, 1e-9), available_h / max(self.height, 1e-9))
+        cx, cy = self.center
+        return (scale, (-cx * scale, -cy * scale))
+
+
+@dataclass
+class SubtreeBounds:
+    # Indices of the Push and the matching Pop in the generation's command stream
+    start: int
+    end: int
+    bounds: Bounds
+
+
+@dataclass
+class Layout:
+    bounds: Bounds = field(default_factory=Bounds)
+    subtrees: List[SubtreeBounds] = field(default_factory=list)
+
+    def cull(self, commands: Iterable[Command], viewport: Bounds) -> Iterator[Command]:
+        '''Yields the commands, skipping every bracketed subtree that lies
+        entirely outside the viewport. Only valid for the command stream
+        this layout was measured from.'''
+        ends: Dict[int, int] = {
+            subtree.start: subtree.end
+            for subtree in self.subtrees
+            if not subtree.bounds.intersects(viewport)
+        }
+        skip_until = -1
+        for i, cmd in enumerate(commands):
+            if i <= skip_until:
+                continue
+            if i in ends:
+                skip_until = ends[i]
+                continue
+            yield cmd
+
+
+class BoundsTracker:
+    '''Accumulates a Layout while a geometry pass walks a command stream.
+
+    The walker reports every command it emits, in order, along with the
+    position it ends up at; the tracker keeps one Bounds per open bracket
+    and folds it into its parent when the bracket closes.'''
+
+    def __init__(self, start: Point) -> None:
+        self.layout = Layout()
+        self.index = 0
+        self.open: List[Tuple[int, Bounds]] = []
+        self.current = self.layout.bounds
+        self.current.include(start)
+
+    def push(self, pos: Point) -> None:
+        bounds = Bounds()
+        bounds.include(pos)
+        self.open.append((self.index, bounds))
+        self.current = bounds
+        self.index += 1
+
+    def pop(self) -> None:
+        start, bounds = self.open.pop()
+        self.layout.subtrees.append(SubtreeBounds(start, self.index, bounds))
+        self.current = self.open[-1][1] if self.open else self.layout.bounds
+        self.current.extend(bounds)
+        self.index += 1
+
+    def move(self, pos: Point) -> None:
+        self.current.include(pos)
+        self.index += 1
+
+    def skip(self) -> None:
+        self.index += 1
+
+    def finish(self) -> Layout:
+        # Unbalanced pushes still contribute to the overall bounds
+        while self.open:
+            start, bounds = self.open.pop()
+            self.layout.bounds.extend(bounds)
+        self.layout.subtrees.sort(key=lambda subtree: subtree.start)
+        return self.layout
+
+
+def tile(bounds: List[Bounds], columns: int, gap: float = 0) -> List[Point]:
+    '''Lays out several trees in a grid, one per cell, row by row. Returns
+    the translation to apply to each tree so its bounds land in its cell.'''
+    if not bounds:
+        return []
+    cell_w = max(b.width for b in bounds) + gap
+    cell_h = max(b.height for b in bounds) + gap
+    offsets = []
+    for i, b in enumerate(bounds):
+        row, column = divmod(i, columns)
+        cx, cy = b.center
+        offsets.append((column * cell_w - cx, -row * cell_h - cy))
+    return offsets
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import List, Optional
+from dataclasses import dataclass
+from enum import Enum
+import sys
+
+from .branch import Branch
+from .rope import CommandRope, RopeConcat, RopeLeaf
+
+
+def _approximate_command_size() -> int:
+    # A freshly built branch, its attribute dict and its slot in a rope
+    sample = Branch(angle=1.5, length=2.5, energy=3.5)
+    attributes = dict(angle=sample.angle, length=sample.length, resistance=sample.resistance, energy=sample.energy)
+    return sys.getsizeof(sample) + sys.getsizeof(attributes) + 8
+
+
+def _approximate_node_size() -> int:
+    # A concatenation and its tuple of parts
+    sample = RopeConcat([RopeLeaf(()), RopeLeaf(())])
+    return sys.getsizeof(sample) + sys.getsizeof(sample.parts)
+
+
+APPROXIMATE_COMMAND_BYTES = _approximate_command_size()
+APPROXIMATE_NODE_BYTES = _approximate_node_size()
+
+
+def resident_bytes(rope: CommandRope) -> int:
+    '''Roughly how much memory a rope holds on to: every distinct node
+    and every distinct command, however often each one is repeated.'''
+    return rope.node_count() * APPROXIMATE_NODE_BYTES + rope.command_count() * APPROXIMATE_COMMAND_BYTES
+
+
+class BudgetPolicy(Enum):
+    # Stop at the last generation that fits
+    STOP = 'stop'
+
+    # Keep going, but only rewrite as many of the highest-energy branches
+    # as fit; everything else is carried over to the next generation as-is.
+    # Context-free systems rewrite shared nodes all at once, so they can
+    # only leave out whole energy levels: when every branch has the same
+    # energy (as in the traditional systems), this behaves exactly like STOP.
+    PRUNE = 'prune'
+
+
+class BudgetOutcome(Enum):
+    # Every generation was expanded in full
+    COMPLETE = 'complete'
+
+    # Expansion ended before the requested depth
+    STOPPED = 'stopped'
+
+    # The requested depth was reached, but some generations were pruned
+    PRUNED = 'pruned'
+
+    # Some generations were pruned, and then even a pruned generation
+    # didn't fit, so expansion ended before the requested depth
+    PRUNED_AND_STOPPED = 'pruned_and_stopped'
+
+    @property
+    def pruned(self) -> bool:
+        return self in (BudgetOutcome.PRUNED, BudgetOutcome.PRUNED_AND_STOPPED)
+
+    @property
+    def stopped(self) -> bool:
+        return self in (BudgetOutcome.STOPPED, BudgetOutcome.PRUNED_AND_STOPPED)
+
+
+@dataclass
+class Budget:
+    # max_commands caps the length of the *expanded* generation, which is
+    # what every consumer ends up walking. max_bytes caps the memory it
+    # holds: one command's worth per command for a flat generation, but
+    # only the distinct nodes and commands of a shared (context-free) rope.
+    max_commands: Optional[int] = None
+    max_bytes: Optional[int] = None
+    policy: BudgetPolicy = BudgetPolicy.STOP
+
+    def command_limit(self, shared: bool = False) -> Optional[int]:
+        limits: List[int] = []
+        if self.max_commands is not None:
+            limits.append(self.max_commands)
+        if self.max_bytes is not None and not shared:
+            limits.append(self.max_bytes // APPROXIMATE_COMMAND_BYTES)
+        return min(limits) if limits else None
+
+    def holds(self, rope: CommandRope) -> bool:
+        '''Whether a shared rope fits in max_bytes.'''
+        return self.max_bytes is None or resident_bytes(rope) <= self.max_bytes
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, rewritten: int, emitted: int) -> None:
+        super().__init__(f"Command budget exceeded after rewriting {rewritten} branches into {emitted} commands")
+        self.rewritten = rewritten
+        self.emitted = emitted
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional, Tuple
+from dataclasses import dataclass
+import math
+
+if TYPE_CHECKING:
+    from .grid import AngleGrid
+
+
+@dataclass
+class CursorSnapshot:
+    pos: Tuple[float, float]
+    heading: float
+
+    # The angle grid the cursor tracked its heading on, if any, so that a
+    # cursor made from the snapshot walks exactly the way it would have
+    grid: Optional[AngleGrid] = None
+
+
+class Cursor:
+    '''A headless stand-in for a turtle: tracks a position and heading
+    (in degrees, counterclockwise from east) and nothing else.
+
+    This is what expansion and the other geometry passes walk with, so
+    that none of them need `turtle` or Tk to be importable.'''
+
+    def __init__(self, start_x: float = 0, start_y: float = 0, start_heading: float = 0) -> None:
+        self.x = start_x
+        self.y = start_y
+        self.angle = start_heading
+
+    def clone(self) -> Cursor:
+        return Cursor(self.x, self.y, self.angle)
+
+    @staticmethod
+    def from_snapshot(snapshot: CursorSnapshot) -> Cursor:
+        if snapshot.grid is not None:
+            return snapshot.grid.cursor(snapshot.pos[0], snapshot.pos[1], snapshot.heading)
+        return Cursor(snapshot.pos[0], snapshot.pos[1], snapshot.heading)
+
+    def pos(self) -> Tuple[float, float]:
+        return (self.x, self.y)
+
+    def heading(self) -> float:
+        # Matches turtle.heading(), which always reports within [0, 360)
+        return self.angle % 360
+
+    def left(self, angle: float) -> None:
+        self.angle += angle
+
+    def right(self, angle: float) -> None:
+        self.angle -= angle
+
+    def forward(self, distance: float) -> None:
+        radians = math.radians(self.angle)
+        self.x += distance * math.cos(radians)
+        self.y += distance * math.sin(radians)
+
+    def snapshot(self) -> CursorSnapshot:
+        return CursorSnapshot(pos=self.pos(), heading=self.heading())
+
+    def restore(self, snapshot: CursorSnapshot) -> None:
+        self.x, self.y = snapshot.pos
+        self.angle = snapshot.heading
@@ -0,0 +1,421 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, FrozenSet, List, Optional, Sequence, Set, Tuple, Union
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import random
+
+from .branch import Command, Branch, Push, Pop
+from .bounds import BoundsTracker, Layout
+from .cursor import Cursor, CursorSnapshot
+from .interpreter import naive_interpret
+from .lsystem import BranchSnapshot, Expansion, Generation
+from .rope import RopeLeaf
+
+if TYPE_CHECKING:
+    from .lsystem import LSystem
+
+
+# Decides, given what a rule saw last time, whether a change to the rules
+# could make it produce something different now.
+AffectedPredicate = Callable[[BranchSnapshot], bool]
+
+NO_READS: FrozenSet[str] = frozenset()
+
+
+def rules_unchanged(_: BranchSnapshot) -> bool:
+    '''The AffectedPredicate for regenerating with the same rules, e.g.
+    with only a new energy budget.'''
+    return False
+
+
+class _RecordingSnapshot(BranchSnapshot):
+    '''A snapshot that remembers which of its fields the rule looked at,
+    so that only changes to those fields invalidate the derivation.'''
+
+    def __init__(self, branch: Branch, energy_surplus: float, pos: Tuple[float, float], heading: float) -> None:
+        self.reads: Set[str] = set()
+        super().__init__(branch, energy_surplus, pos, heading)
+
+    @property
+    def energy_surplus(self) -> float:
+        self.reads.add('energy_surplus')
+        return self._energy_surplus
+
+    @energy_surplus.setter
+    def energy_surplus(self, value: float) -> None:
+        self._energy_surplus = value
+
+    @property
+    def pos(self) -> Tuple[float, float]:
+        self.reads.add('pos')
+        return self._pos
+
+    @pos.setter
+    def pos(self, value: Tuple[float, float]) -> None:
+        self._pos = value
+
+    @property
+    def heading(self) -> float:
+        self.reads.add('heading')
+        return self._heading
+
+    @heading.setter
+    def heading(self, value: float) -> None:
+        self._heading = value
+
+
+# The raw state of a cursor: position and unnormalized heading. Restoring
+# it reproduces a walk bit for bit, unlike restoring a CursorSnapshot.
+RawState = Tuple[float, float, float]
+
+# A stretch of a generation that was carried over unchanged from the old
+# derivation: (start in the new generation, start in the old one, length)
+OriginRun = Tuple[int, int, int]
+
+
+@dataclass
+class DerivationStep:
+    # One generation, flattened. Every other list has one entry per command
+    # (`starts`, `states` and `depths` have one more, for the end).
+    commands: List[Command]
+
+    # The seed `random` is reset to before the command's rule runs
+    seeds: List[int]
+
+    # Command i turned into [starts[i], starts[i + 1]) of the next generation
+    starts: List[int] = field(default_factory=list)
+
+    # The cursor and the bracket depth just before each command
+    states: List[RawState] = field(default_factory=list)
+    depths: List[int] = field(default_factory=list)
+
+    # What the rule saw, and which of the fields that depend on the rest of
+    # the tree it actually read. Push, Pop and branches without a rule have
+    # neither.
+    snapshots: List[Optional[BranchSnapshot]] = field(default_factory=list)
+    reads: List[FrozenSet[str]] = field(default_factory=list)
+
+    # Indices of every Push and Pop, ascending
+    brackets: List[int] = field(default_factory=list)
+
+    surplus: float = 0
+    surplus_readers: List[int] = field(default_factory=list)
+
+
+class Derivation:
+    '''An expansion along with how every generation was derived from the
+    previous one, which is what lets `regenerate` redo only part of it.'''
+
+    def __init__(self, steps: List[DerivationStep],
+                       final: DerivationStep,
+                       expansion: Expansion,
+                       origin: CursorSnapshot,
+                       available_energy: float,
+                       seed: int,
+                       rules_run: int) -> None:
+        self.steps = steps
+        self.final = final
+        self.expansion = expansion
+        self.origin = origin
+        self.available_energy = available_energy
+        self.seed = seed
+
+        # How many rules were actually run to produce this derivation; the
+        # rest were spliced in from the derivation it was regenerated from
+        self.rules_run = rules_run
+
+    def generation(self, depth: int) -> DerivationStep:
+        return self.steps[depth] if depth < len(self.steps) else self.final
+
+
+def _mix(seed: int, index: int) -> int:
+    # Tuples of ints hash the same way on every run
+    return hash((seed, index)) & 0xFFFFFFFFFFFF
+
+
+def _same_commands(a: Sequence[Command], b: Sequence[Command]) -> bool:
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if isinstance(x, Branch) or isinstance(y, Branch):
+            if x != y:
+                return False
+        elif type(x) is not type(y):
+            return False
+    return True
+
+
+def _unchanged(old: BranchSnapshot, new: BranchSnapshot, reads: FrozenSet[str]) -> bool:
+    return (('pos' not in reads or old.pos == new.pos)
+            and ('heading' not in reads or old.heading == new.heading)
+            and ('energy_surplus' not in reads or old.energy_surplus == new.energy_surplus))
+
+
+def _raw_state(cursor: Cursor) -> RawState:
+    return (cursor.x, cursor.y, cursor.angle)
+
+
+def derive(lsystem: LSystem,
+           t: Cursor,
+           depth: Optional[int] = None,
+           available_energy: float = 100,
+           seed: int = 0,
+           previous: Optional[Derivation] = None,
+           affected: Optional[AffectedPredicate] = None) -> Derivation:
+    if depth is None:
+        depth = lsystem.recommended_depth
+
+    # Every rule call reseeds `random` from its position in the derivation
+    # tree, so an untouched subtree draws the same numbers no matter what
+    # changed around it. Afterwards `random` is reseeded from the caller's
+    # own stream, so it doesn't stay pinned to our last seed.
+    resume = random.getrandbits(64)
+    try:
+        return _Deriver(lsystem, t.snapshot(), available_energy, seed, previous, affected).run(depth)
+    finally:
+        random.seed(resume)
+
+
+class _Deriver:
+    '''Derives one generation at a time. Without a previous derivation every
+    rule runs. With one, the walk alternates between two modes:
+
+    - While the cursor, the bracket stack and the command being looked at
+      all match the previous derivation ("in sync"), whole runs of commands
+      are copied over with their spans, and the cursor jumps straight to the
+      recorded state at the end of the run. Only commands flagged by
+      `affected` (every rule, if it's None), or that read a surplus that
+      has changed, interrupt a run.
+    - Otherwise commands are handled one at a time: rules whose inputs
+      changed are re-run (with their old seed), and everything is walked,
+      until the state lines up with the previous derivation again.'''
+
+    def __init__(self, lsystem: LSystem,
+                       origin: CursorSnapshot,
+                       available_energy: float,
+                       seed: int,
+                       previous: Optional[Derivation],
+                       affected: Optional[AffectedPredicate]) -> None:
+        self.lsystem = lsystem
+        self.origin = origin
+        self.available_energy = available_energy
+        self.seed = seed
+        self.previous = previous
+        self.affected = affected
+        self.rules_run = 0
+
+    def run(self, depth: int) -> Derivation:
+        previous = self.previous
+        commands: List[Command] = list(self.lsystem.seed)
+        seeds = [_mix(self.seed, i) for i in range(len(commands))]
+        runs: List[OriginRun] = []
+        if (previous is not None and previous.seed == self.seed and previous.origin == self.origin
+                and _same_commands(commands, previous.generation(0).commands)):
+            commands = list(previous.generation(0).commands)
+            runs = [(0, 0, len(commands))]
+
+        # A full derivation walks everything anyway, so it tracks bounds as
+        # it goes. A regeneration skips most of the walk, so its layouts
+        # are measured on demand.
+        track = previous is None
+        steps: List[DerivationStep] = []
+        generations: List[Generation] = []
+        layout = None
+        origin = self.lsystem.place_on_grid(self.origin, commands)
+        if track:
+            seed_tracker = BoundsTracker(self.origin.pos)
+            naive_interpret(Cursor.from_snapshot(origin), commands, seed_tracker)
+            layout = seed_tracker.finish()
+
+        # Every generation is walked on the grid its own angles call for,
+        # just like `LSystem.generations` walks it. The walk lays out the
+        # next generation, which is stamped with the grid it was laid out
+        # on, so that measuring it again from its origin agrees (and so
+        # does a regeneration, which only measures).
+        stamp = origin
+        for k in range(depth):
+            generations.append(Generation(k, RopeLeaf(commands), stamp, layout))
+            step = DerivationStep(commands, seeds)
+            old = old_next = None
+            if previous is not None and k < len(previous.steps):
+                old, old_next = previous.steps[k], previous.generation(k + 1)
+            tracker = BoundsTracker(self.origin.pos) if track else None
+            commands, seeds, runs = self.step(step, runs, old, old_next, tracker, origin)
+            layout = None if tracker is None else tracker.finish()
+            steps.append(step)
+            stamp = origin
+            origin = self.lsystem.place_on_grid(self.origin, commands)
+
+        final = DerivationStep(commands, seeds)
+        generation = Generation(depth, RopeLeaf(commands), stamp, layout)
+        sizes = [len(g.commands) for g in generations] + [len(commands)]
+        history: List[Union[Layout, Generation]] = [g if g.measured is None else g.measured for g in generations]
+        expansion = Expansion(generation, history, sizes, depth)
+        return Derivation(steps, final, expansion, self.origin, self.available_energy, self.seed, self.rules_run)
+
+    def step(self, step: DerivationStep,
+                   runs: List[OriginRun],
+                   old: Optional[DerivationStep],
+                   old_next: Optional[DerivationStep],
+                   tracker: Optional[BoundsTracker],
+                   origin: CursorSnapshot) -> Tuple[List[Command], List[int], List[OriginRun]]:
+        commands = step.commands
+        rules = self.lsystem.rules
+        cursor = Cursor.from_snapshot(origin)
+        stack: List[CursorSnapshot] = []
+
+        # Whether each stack entry matches the previous derivation's, and
+        # how many don't. We're only in sync when they all do.
+        stack_ok: List[bool] = []
+        bad_entries = 0
+
+        next_commands: List[Command] = []
+        next_seeds: List[int] = []
+        next_runs: List[OriginRun] = []
+
+        surplus: Optional[float] = None
+
+        def get_surplus() -> float:
+            nonlocal surplus
+            if surplus is None:
+                used = sum(cmd.energy for cmd in commands if isinstance(cmd, Branch))
+                surplus = max(self.available_energy - used, 0)
+            return surplus
+
+        def carry_over(old_start: int, length: int) -> None:
+            offset = len(next_commands)
+            if next_runs and next_runs[-1][0] + next_runs[-1][2] == offset and next_runs[-1][1] + next_runs[-1][2] == old_start:
+                new_start, run_old_start, run_length = next_runs.pop()
+                next_runs.append((new_start, run_old_start, run_length + length))
+            else:
+                next_runs.append((offset, old_start, length))
+
+        # Old commands that must be looked at individually even when in sync
+        flagged: List[int] = []
+        if old is not None:
+            affected = self.affected
+            flagged = [
+                o for o, snapshot in enumerate(old.snapshots)
+                if snapshot is not None and (affected is None or affected(snapshot))
+            ]
+            if old.surplus_readers and get_surplus() != old.surplus:
+                flagged = sorted(set(flagged).union(old.surplus_readers))
+
+        run_index = 0
+        i = 0
+        while i < len(commands):
+            while run_index < len(runs) and runs[run_index][0] + runs[run_index][2] <= i:
+                run_index += 1
+            o: Optional[int] = None
+            run_end = i
+            if run_index < len(runs) and runs[run_index][0] <= i:
+                new_start, old_start, length = runs[run_index]
+                o = old_start + (i - new_start)
+                run_end = new_start + length
+
+            if (o is not None and old is not None and old_next is not None
+                    and bad_entries == 0
+                    and len(stack) == old.depths[o]
+                    and _raw_state(cursor) == old.states[o]):
+                # In sync: copy everything up to the next flagged command
+                end = o + (run_end - i)
+                next_flag = bisect_left(flagged, o)
+                if next_flag < len(flagged) and flagged[next_flag] < end:
+                    end = flagged[next_flag]
+                if end > o:
+                    a, b = old.starts[o], old.starts[end]
+                    offset = len(next_commands)
+                    carry_over(a, b - a)
+                    next_commands.extend(old_next.commands[a:b])
+                    next_seeds.extend(old_next.seeds[a:b])
+                    step.starts.extend([start - a + offset for start in old.starts[o:end]])
+                    step.states.extend(old.states[o:end])
+                    step.depths.extend(old.depths[o:end])
+                    step.snapshots.extend(old.snapshots[o:end])
+                    step.reads.extend(old.reads[o:end])
+                    for q in old.brackets[bisect_left(old.brackets, o):bisect_left(old.brackets, end)]:
+                        step.brackets.append(q - o + i)
+                        if isinstance(old.commands[q], Push):
+                            x, y, angle = old.states[q]
+                            stack.append(CursorSnapshot(pos=(x, y), heading=angle % 360))
+                            stack_ok.append(True)
+                        else:
+                            stack.pop()
+                            stack_ok.pop()
+                    for q in old.surplus_readers[bisect_left(old.surplus_readers, o):bisect_left(old.surplus_readers, end)]:
+                        step.surplus_readers.append(q - o + i)
+                    cursor.x, cursor.y, cursor.angle = old.states[end]
+                    i += end - o
+                    continue
+
+            cmd = commands[i]
+            step.starts.append(len(next_commands))
+            step.states.append(_raw_state(cursor))
+            step.depths.append(len(stack))
+            snapshot: Optional[BranchSnapshot] = None
+            reads = NO_READS
+            out: List[Command] = [cmd]
+            out_origin: Optional[int] = None
+            if o is not None and old is not None:
+                out_origin = old.starts[o]
+
+            if isinstance(cmd, Push):
+                step.brackets.append(i)
+                ok = o is not None and old is not None and _raw_state(cursor) == old.states[o]
+                stack.append(cursor.snapshot())
+                stack_ok.append(ok)
+                bad_entries += 0 if ok else 1
+                if tracker is not None:
+                    tracker.push(cursor.pos())
+            elif isinstance(cmd, Pop):
+                step.brackets.append(i)
+                cursor.restore(stack.pop())
+                bad_entries -= 0 if stack_ok.pop() else 1
+                if tracker is not None:
+                    tracker.pop()
+            elif isinstance(cmd, Branch):
+                if cmd.kind in rules:
+                    snapshot = BranchSnapshot(cmd, energy_surplus=get_surplus(), pos=cursor.pos(), heading=cursor.heading())
+                    out_origin = None
+                    old_span: Optional[List[Command]] = None
+                    old_start = 0
+                    if o is not None and old is not None and old_next is not None:
+                        old_start, old_end = old.starts[o], old.starts[o + 1]
+                        old_span = old_next.commands[old_start:old_end]
+                        old_snapshot = old.snapshots[o]
+                        assert old_snapshot is not None
+                        if (self.affected is not None and not self.affected(old_snapshot)
+                                and _unchanged(old_snapshot, snapshot, old.reads[o])):
+                            out, reads, out_origin = old_span, old.reads[o], old_start
+                    if out_origin is None:
+                        random.seed(step.seeds[i])
+                        recording = _RecordingSnapshot(cmd, snapshot.energy_surplus, snapshot.pos, snapshot.heading)
+                        out = rules[cmd.kind](recording)
+                        reads = frozenset(recording.reads)
+                        self.rules_run += 1
+                        if old_span is not None and _same_commands(out, old_span):
+                            # The rule still produces the same thing, so the
+                            # old subtree below it can be kept as well
+                            out, out_origin = old_span, old_start
+                    if 'energy_surplus' in reads:
+                        step.surplus_readers.append(i)
+                naive_interpret(cursor, out, tracker)
+            else:
+                raise Exception(f"Unrecognized command: {cmd}", cmd)
+
+            step.snapshots.append(snapshot)
+            step.reads.append(reads)
+            if out_origin is not None and old_next is not None:
+                carry_over(out_origin, len(out))
+                next_seeds.extend(old_next.seeds[out_origin:out_origin + len(out)])
+            else:
+                next_seeds.extend(_mix(step.seeds[i], j) for j in range(len(out)))
+            next_commands.extend(out)
+            i += 1
+
+        step.starts.append(len(next_commands))
+        step.states.append(_raw_state(cursor))
+        step.depths.append(len(stack))
+        step.surplus = get_surplus() if surplus is not None or step.surplus_readers else 0
+        return next_commands, next_seeds, next_runs
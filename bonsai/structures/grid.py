@@ -0,0 +1,370 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from fractions import Fraction
+import math
+
+from .branch import Command, Branch, Push, Pop
+from .bounds import Bounds, Point
+from .cursor import Cursor, CursorSnapshot
+from .interpreter import naive_interpret
+from .rope import BracketDepths, CommandRope, IdentityMemo, RopeLeaf, RopeConcat
+
+# Positions closer together than this are treated as the same vertex
+DEFAULT_RESOLUTION = 1e-6
+
+# Angles are recognized as multiples of a base angle if they're fractions
+# of a degree with a denominator up to this
+MAX_DENOMINATOR = 64
+
+# Beyond this many steps per turn the tables stop paying for themselves
+MAX_STEPS = 1 << 16
+
+VertexKey = Tuple[int, int]
+
+# Walking a rope node from a given grid step, starting at the origin: the
+# position and step it ends up at, and the bounds of everything it visits
+RopeSummary = Tuple[float, float, int, Bounds]
+
+
+def _unit(angle: Fraction) -> Tuple[float, float]:
+    # Folds the angle into [0, 45] degrees and unfolds the result with
+    # exact sign flips and swaps, so that e.g. the cosine of 90 is exactly
+    # 0 and the sine of 135 is exactly the sine of 45.
+    sin_sign = 1
+    if angle > 180:
+        angle, sin_sign = 360 - angle, -1
+    cos_sign = 1
+    if angle > 90:
+        angle, cos_sign = 180 - angle, -1
+    swap = angle > 45
+    if swap:
+        angle = 90 - angle
+
+    if angle == 0:
+        cos, sin = 1.0, 0.0
+    elif angle == 30:
+        cos, sin = math.sqrt(3) / 2, 0.5
+    elif angle == 45:
+        cos = sin = math.sqrt(0.5)
+    else:
+        radians = math.radians(float(angle))
+        cos, sin = math.cos(radians), math.sin(radians)
+    if swap:
+        cos, sin = sin, cos
+    return (cos_sign * cos, sin_sign * sin)
+
+
+def _gcd(a: Fraction, b: Fraction) -> Fraction:
+    return Fraction(math.gcd(a.numerator * b.denominator, b.numerator * a.denominator), a.denominator * b.denominator)
+
+
+class AngleGrid:
+    '''Headings that are all multiples of one base angle (which divides
+    360), along with the sine and cosine of every one of them.
+
+    Tracking a heading as a whole number of steps means turning never
+    accumulates error, and looking its sine and cosine up means two
+    moves in the same direction always move by exactly the same amount.
+    The tables only depend on the angle, so a heading moves by the same
+    amount on every grid it lies on.'''
+
+    def __init__(self, base: Fraction) -> None:
+        self.base = base
+        self.steps = int(360 / base)
+        units = [_unit(base * k) for k in range(self.steps)]
+        self.cos = [cos for cos, _ in units]
+        self.sin = [sin for _, sin in units]
+        self._cache: Dict[float, int] = {}
+
+    def __repr__(self) -> str:
+        return f"AngleGrid(base={self.base})"
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, AngleGrid) and other.base == self.base
+
+    def __hash__(self) -> int:
+        return hash(self.base)
+
+    @staticmethod
+    def for_angles(angles: Iterable[float]) -> Optional[AngleGrid]:
+        '''The coarsest grid every one of the angles lies on, if any.'''
+        base = Fraction(360)
+        for angle in angles:
+            exact = Fraction(angle).limit_denominator(MAX_DENOMINATOR)
+            if abs(float(exact) - angle) > 1e-9:
+                return None
+            base = _gcd(base, abs(exact))
+            if base == 0 or 360 / base > MAX_STEPS:
+                return None
+        return AngleGrid.of(base)
+
+    @staticmethod
+    def of(base: Fraction) -> AngleGrid:
+        '''The grid with this base, sharing its tables with every other
+        user of it.'''
+        grid = _GRIDS.get(base)
+        if grid is None:
+            grid = _GRIDS[base] = AngleGrid(base)
+        return grid
+
+    @staticmethod
+    def for_commands(commands: Iterable[Command], start_heading: float = 0) -> Optional[AngleGrid]:
+        # A rope only needs each of its distinct leaves looked at
+        if isinstance(commands, CommandRope):
+            angles, _ = _rope_angles(commands)
+        else:
+            angles = {cmd.angle for cmd in commands if isinstance(cmd, Branch)}
+        angles.add(start_heading)
+        return AngleGrid.for_angles(angles)
+
+    def cursor(self, start_x: float = 0, start_y: float = 0, start_heading: float = 0) -> GridCursor:
+        return GridCursor(self, start_x, start_y, start_heading)
+
+    def to_steps(self, angle: float) -> Optional[int]:
+        '''The angle as a whole number of steps, or None if it's off the grid.'''
+        steps = self._cache.get(angle)
+        if steps is None:
+            exact = float(angle) / float(self.base)
+            steps = round(exact)
+            if abs(steps - exact) > 1e-6:
+                return None
+            self._cache[angle] = steps
+        return steps
+
+
+_GRIDS: Dict[Fraction, AngleGrid] = {}
+
+
+class GridCursor(Cursor):
+    '''A cursor whose heading is a whole number of grid steps.
+
+    Turning only ever adds integers, moving uses the grid's tables, and a
+    snapshot round-trips exactly, so walking the same commands from the
+    same place always lands on bit-identical positions, and curves that
+    should close do (to within float addition, not trigonometry).
+
+    An angle that's off the grid takes the heading off it too, and until
+    a turn or a restore brings it back the cursor behaves exactly like a
+    plain Cursor. Which of the two it does depends only on the heading,
+    never on how it got there, so restoring a state reproduces a walk.'''
+
+    def __init__(self, grid: AngleGrid, start_x: float = 0, start_y: float = 0, start_heading: float = 0) -> None:
+        self.grid = grid
+
+        # The heading is `step` grid steps if `exact` is set, and `raw`
+        # degrees (like a plain Cursor's angle) if not
+        self.step = 0
+        self.exact = True
+        self.raw = 0.0
+        super().__init__(start_x, start_y, start_heading)
+
+    @staticmethod
+    def for_commands(commands: Iterable[Command],
+                     start_x: float = 0,
+                     start_y: float = 0,
+                     start_heading: float = 0) -> Cursor:
+        '''A GridCursor if every angle in the commands is commensurate,
+        and a plain Cursor if not.'''
+        grid = AngleGrid.for_commands(commands, start_heading)
+        if grid is None:
+            return Cursor(start_x, start_y, start_heading)
+        return GridCursor(grid, start_x, start_y, start_heading)
+
+    @property
+    def angle(self) -> float:
+        return float(self.step * self.grid.base) if self.exact else self.raw
+
+    @angle.setter
+    def angle(self, value: float) -> None:
+        steps = self.grid.to_steps(value)
+        if steps is None:
+            self.exact = False
+            self.raw = value
+        else:
+            self.exact = True
+            self.step = steps % self.grid.steps
+
+    def clone(self) -> GridCursor:
+        clone = GridCursor(self.grid, self.x, self.y)
+        clone.step, clone.exact, clone.raw = self.step, self.exact, self.raw
+        return clone
+
+    def heading(self) -> float:
+        return self.angle if self.exact else self.raw % 360
+
+    def left(self, angle: float) -> None:
+        steps = self.grid.to_steps(angle) if self.exact else None
+        if steps is None:
+            self.angle = self.angle + angle
+        else:
+            self.step = (self.step + steps) % self.grid.steps
+
+    def right(self, angle: float) -> None:
+        steps = self.grid.to_steps(angle) if self.exact else None
+        if steps is None:
+            self.angle = self.angle - angle
+        else:
+            self.step = (self.step - steps) % self.grid.steps
+
+    def forward(self, distance: float) -> None:
+        if self.exact:
+            self.x += distance * self.grid.cos[self.step]
+            self.y += distance * self.grid.sin[self.step]
+        else:
+            super().forward(distance)
+
+    def snapshot(self) -> CursorSnapshot:
+        return CursorSnapshot(pos=(self.x, self.y), heading=self.heading(), grid=self.grid)
+
+
+class RopeExtents:
+    '''Computes the bounds of ropes from their structure, without walking
+    every command.
+
+    With every heading on an angle grid, a node entered at a given step
+    always draws the same shape, wherever it starts. So each distinct node
+    is walked once per step it's entered with, and its shape is translated
+    everywhere else it appears: the cost grows with the number of distinct
+    nodes rather than the length of the rope. Only nodes whose brackets
+    balance can be summarized like that; the rest are walked part by part.
+    Summaries are kept between calls, so measuring successive generations
+    of a context-free system only pays for the nodes that are new.'''
+
+    def __init__(self) -> None:
+        self.grid: Optional[AngleGrid] = None
+
+        self._summaries: IdentityMemo[CommandRope, RopeSummary] = IdentityMemo()
+        self.depths = BracketDepths()
+
+    def bounds(self, t: Cursor, rope: CommandRope) -> Optional[Bounds]:
+        '''The bounds of walking the rope from the cursor (which doesn't
+        move), or None if its angles don't lie on a common grid or it
+        shares too little structure for this to beat a plain walk.'''
+        angles, distinct = _rope_angles(rope)
+        if 2 * distinct > len(rope):
+            return None
+        angles.add(t.heading())
+        grid = AngleGrid.for_angles(angles)
+        if grid is None:
+            return None
+        if self.grid is None or self.grid.base != grid.base:
+            self.grid = grid
+            self._summaries.clear()
+        step = self.grid.to_steps(t.heading())
+        assert step is not None
+        walk = _RopeWalk(self, self.grid, t.x, t.y, step)
+        walk.visit(rope)
+        return walk.bounds
+
+    def summary(self, node: CommandRope, step: int) -> RopeSummary:
+        summary = self._summaries.get(node, step)
+        if summary is None:
+            assert self.grid is not None
+            walk = _RopeWalk(self, self.grid, 0, 0, step)
+            walk.walk(node)
+            summary = self._summaries.put(node, (walk.x, walk.y, walk.step, walk.bounds), step)
+        return summary
+
+
+def _rope_angles(rope: CommandRope) -> Tuple[Set[float], int]:
+    # Every angle in the rope, and how many commands its distinct leaves
+    # hold between them
+    angles: Set[float] = set()
+    distinct = 0
+    seen: Set[int] = set()
+    stack = [rope]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, RopeLeaf):
+            for cmd in node.commands:
+                if isinstance(cmd, Branch):
+                    angles.add(cmd.angle)
+            distinct += node.length
+        else:
+            assert isinstance(node, RopeConcat)
+            stack.extend(node.parts)
+    return angles, distinct
+
+
+class _RopeWalk:
+    def __init__(self, extents: RopeExtents, grid: AngleGrid, x: float, y: float, step: int) -> None:
+        self.extents = extents
+        self.grid = grid
+        self.x = x
+        self.y = y
+        self.step = step
+        self.stack: List[Tuple[float, float, int]] = []
+        self.bounds = Bounds()
+        self.bounds.include((x, y))
+
+    def visit(self, node: CommandRope) -> None:
+        if self.extents.depths.balanced(node):
+            dx, dy, step, bounds = self.extents.summary(node, self.step)
+            self.bounds.include((self.x + bounds.min_x, self.y + bounds.min_y))
+            self.bounds.include((self.x + bounds.max_x, self.y + bounds.max_y))
+            self.x += dx
+            self.y += dy
+            self.step = step
+        else:
+            self.walk(node)
+
+    def walk(self, node: CommandRope) -> None:
+        if isinstance(node, RopeConcat):
+            for part in node.parts:
+                self.visit(part)
+            return
+        assert isinstance(node, RopeLeaf)
+        grid = self.grid
+        for cmd in node.commands:
+            if isinstance(cmd, Push):
+                self.stack.append((self.x, self.y, self.step))
+            elif isinstance(cmd, Pop):
+                self.x, self.y, self.step = self.stack.pop()
+            elif isinstance(cmd, Branch):
+                steps = grid.to_steps(cmd.angle)
+                assert steps is not None  # The grid was picked to fit every angle
+                self.step = (self.step + steps) % grid.steps
+                self.x += cmd.length * grid.cos[self.step]
+                self.y += cmd.length * grid.sin[self.step]
+                self.bounds.include((self.x, self.y))
+            else:
+                raise Exception(f"Unrecognized command: {cmd}", cmd)
+
+
+def quantize(pos: Point, resolution: float = DEFAULT_RESOLUTION) -> VertexKey:
+    '''Snaps a position to a grid of the given resolution and returns its
+    cell, which can be hashed and compared exactly.'''
+    return (round(pos[0] / resolution), round(pos[1] / resolution))
+
+
+class VertexIndex:
+    '''Deduplicates vertices with a hash lookup on their quantized position.'''
+
+    def __init__(self, resolution: float = DEFAULT_RESOLUTION) -> None:
+        self.resolution = resolution
+        self.vertices: List[Point] = []
+        self.indices: Dict[VertexKey, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.vertices)
+
+    def index(self, pos: Point) -> int:
+        key = quantize(pos, self.resolution)
+        index = self.indices.get(key)
+        if index is None:
+            index = len(self.vertices)
+            self.indices[key] = index
+            self.vertices.append((key[0] * self.resolution, key[1] * self.resolution))
+        return index
+
+
+def is_closed(t: Cursor, commands: Iterable[Command], resolution: float = DEFAULT_RESOLUTION) -> bool:
+    '''Whether walking the commands brings the cursor back to where it
+    started. Commands inside brackets don't affect the answer.'''
+    start = quantize(t.pos(), resolution)
+    naive_interpret(t, commands)
+    return quantize(t.pos(), resolution) == start
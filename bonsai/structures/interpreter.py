@@ -1,41 +1,86 @@
 from __future__ import annotations
 
-from typing import List, Callable
+from typing import Iterable, Iterator, List, Callable, Optional
+from dataclasses import dataclass
 from .branch import Command, Branch, Push, Pop
-from bonsai.turtle_wrapper import TurtleWrapper, TurtleSnapshot
+from .bounds import BoundsTracker, Layout, Point
+from .rope import CommandRope, RopeBuilder
+from .cursor import Cursor, CursorSnapshot
 
 
-def interpret(t: TurtleWrapper,
-              commands: List[Command],
-              branch_handler: Callable[[TurtleSnapshot, Branch], List[Command]],
-              ) -> List[Command]:
+@dataclass
+class Segment:
+    start: Point
+    end: Point
+    branch: Branch
+
+
+def interpret(t: Cursor,
+              commands: Iterable[Command],
+              branch_handler: Callable[[CursorSnapshot, Branch], List[Command]],
+              tracker: Optional[BoundsTracker] = None,
+              ) -> CommandRope:
     state_stack = []
-    output: List[Command] = []
+    output = RopeBuilder()
     for cmd in commands:
         if isinstance(cmd, Push):
             state_stack.append(t.snapshot())
             output.append(cmd)
+            if tracker is not None:
+                tracker.push(t.pos())
         elif isinstance(cmd, Pop):
             t.restore(state_stack.pop())
             output.append(cmd)
+            if tracker is not None:
+                tracker.pop()
         elif isinstance(cmd, Branch):
             new_commands = branch_handler(t.snapshot(), cmd)
-            naive_interpret(t, new_commands)
+            naive_interpret(t, new_commands, tracker)
             output.extend(new_commands)
         else:
             raise Exception(f"Unrecognized command: {cmd}", cmd)
-    return output
+    return output.build()
 
 
-def naive_interpret(t: TurtleWrapper, commands: List[Command]) -> None:
+def naive_interpret(t: Cursor, commands: Iterable[Command], tracker: Optional[BoundsTracker] = None) -> None:
     state_stack = []
     for cmd in commands:
         if isinstance(cmd, Push):
             state_stack.append(t.snapshot())
+            if tracker is not None:
+                tracker.push(t.pos())
         elif isinstance(cmd, Pop):
             t.restore(state_stack.pop())
+            if tracker is not None:
+                tracker.pop()
         elif isinstance(cmd, Branch):
             t.left(cmd.angle)
             t.forward(cmd.length)
+            if tracker is not None:
+                tracker.move(t.pos())
+        else:
+            raise Exception(f"Unrecognized command: {cmd}", cmd)
+
+
+def measure(t: Cursor, commands: Iterable[Command]) -> Layout:
+    tracker = BoundsTracker(t.pos())
+    naive_interpret(t, commands, tracker)
+    return tracker.finish()
+
+
+def trace(t: Cursor, commands: Iterable[Command]) -> Iterator[Segment]:
+    '''Walks the commands like naive_interpret, yielding every line drawn.'''
+    state_stack = []
+    for cmd in commands:
+        if isinstance(cmd, Push):
+            state_stack.append(t.snapshot())
+        elif isinstance(cmd, Pop):
+            t.restore(state_stack.pop())
+        elif isinstance(cmd, Branch):
+            t.left(cmd.angle)
+            if cmd.length != 0:
+                start = t.pos()
+                t.forward(cmd.length)
+                yield Segment(start, t.pos(), cmd)
         else:
             raise Exception(f"Unrecognized command: {cmd}", cmd)
@@ -1,15 +1,26 @@
 from __future__ import annotations
 
-from typing import Optional, List, Dict, Callable, Tuple
+from typing import TYPE_CHECKING, Optional, Iterable, Iterator, List, Dict, Callable, Tuple, Union
 from dataclasses import dataclass
 
-from bonsai.turtle_wrapper import TurtleWrapper, TurtleSnapshot
 from .branch import Command, Branch, BranchKind, DEFAULT_KIND
-from .interpreter import interpret
+from .bounds import Bounds, BoundsTracker, Layout
+from .budget import Budget, BudgetExceeded, BudgetOutcome, BudgetPolicy
+from .cursor import Cursor, CursorSnapshot
+from .grid import AngleGrid, RopeExtents
+from .interpreter import interpret, measure
+from .primitives import Primitive, Style
+from .rope import CommandRope, IdentityMemo, RopeLeaf, RopeConcat, RopeBuilder, as_rope, concat
+
+
+if TYPE_CHECKING:
+    from .derivation import AffectedPredicate, Derivation
 
 
 BranchTransformer = Callable[['BranchSnapshot'], List[Command]]
-BranchRenderer = Callable[[TurtleWrapper, Branch], None]
+# Given where a branch starts, returns what to draw for it on top of its
+# stroke. Shapes are tagged with a kind, which picks their style.
+BranchRenderer = Callable[[CursorSnapshot, Branch], List[Primitive]]
 
 
 @dataclass
@@ -20,11 +31,89 @@ class BranchSnapshot:
     heading: float
 
 
+@dataclass
+class Generation:
+    depth: int
+    commands: CommandRope
+
+    # Where the generation starts, on the angle grid it's walked on
+    origin: CursorSnapshot
+
+    # Accumulated by the geometry pass that produced this generation.
+    # Context-free systems are expanded without one, so for them it's
+    # measured (with a full walk) the first time `layout` is read.
+    measured: Optional[Layout] = None
+
+    # Set if a command budget forced some branches to be carried over
+    # without being rewritten
+    pruned: bool = False
+
+    # The overall bounds when they're known without a layout: context-free
+    # systems whose angles lie on a grid compute them from the rope's
+    # structure as they expand (see RopeExtents)
+    extent: Optional[Bounds] = None
+
+    @property
+    def layout(self) -> Layout:
+        if self.measured is None:
+            self.measured = measure(Cursor.from_snapshot(self.origin), self.commands)
+        return self.measured
+
+    @property
+    def bounds(self) -> Bounds:
+        '''The overall bounds, walking the commands only if there's no
+        other way to know them.'''
+        if self.measured is None and self.extent is not None:
+            return self.extent
+        return self.layout.bounds
+
+
+class Expansion:
+    def __init__(self, generation: Generation,
+                       history: List[Union[Layout, Generation]],
+                       generation_sizes: List[int],
+                       requested_depth: int,
+                       outcome: BudgetOutcome = BudgetOutcome.COMPLETE) -> None:
+        # The final generation
+        self.generation = generation
+
+        # One entry per earlier generation, seed first. Only the layout is
+        # kept when it's already known; otherwise the generation itself is,
+        # which is cheap since context-free ropes share their nodes.
+        self.history = history
+
+        # The number of commands in every generation, seed first
+        self.generation_sizes = generation_sizes
+
+        self.requested_depth = requested_depth
+        self.outcome = outcome
+
+    @property
+    def depth(self) -> int:
+        return self.generation.depth
+
+    @property
+    def commands(self) -> CommandRope:
+        return self.generation.commands
+
+    @property
+    def layout(self) -> Layout:
+        return self.generation.layout
+
+    @property
+    def generation_bounds(self) -> List[Bounds]:
+        earlier = [entry.bounds for entry in self.history]
+        return earlier + [self.generation.bounds]
+
+
 class LSystem:
     def __init__(self, seed: List[Command],
                        rules: Optional[Dict[BranchKind, BranchTransformer]] = None,
                        render_rules: Optional[Dict[BranchKind, BranchRenderer]] = None,
-                       recommended_depth: int = 3) -> None:
+                       recommended_depth: int = 3,
+                       context_free: bool = False,
+                       styles: Optional[Dict[BranchKind, Style]] = None,
+                       grid: Optional[AngleGrid] = None) -> None:
         self.seed = seed
         if rules is None:
             rules = {}
@@ -32,8 +121,30 @@ class LSystem:
             render_rules = {}
         self.rules = rules
         self.render_rules = render_rules
+        self.styles = {} if styles is None else styles
         self.recommended_depth = recommended_depth
 
+        # If set, the rules promise to look at nothing but `snapshot.branch`
+        # (no position, heading, energy surplus or randomness). Each distinct
+        # branch and each distinct rope node is then rewritten only once per
+        # generation and the results are shared, so memory grows with the
+        # number of distinct structures rather than the expanded length.
+        self.context_free = context_free
+
+        # Headings are tracked as whole steps of this grid while they lie
+        # on it (see GridCursor). Without one, each generation is walked on
+        # the coarsest grid its own angles lie on, if there is one.
+        self.grid = grid
+
+    def place_on_grid(self, start: CursorSnapshot, commands: Iterable[Command]) -> CursorSnapshot:
+        '''`start`, with the grid a generation made of `commands` is walked
+        on: this system's, else the start's own, else one detected from
+        the commands.'''
+        grid = self.grid if self.grid is not None else start.grid
+        if grid is None:
+            grid = AngleGrid.for_commands(commands, start.heading)
+        return CursorSnapshot(start.pos, start.heading, grid)
+
     def add_rule(self, kind: BranchKind) -> Callable[[BranchTransformer], BranchTransformer]:
         def adder(transformer: BranchTransformer) -> BranchTransformer:
             if kind in self.rules:
@@ -53,25 +164,255 @@ class LSystem:
     def add_default_rule(self) -> Callable[[BranchTransformer], BranchTransformer]:
         return self.add_rule(DEFAULT_KIND)
 
-    def expand(self, t: TurtleWrapper, depth: Optional[int] = None, available_energy: float = 100) -> List[Command]:
+    def expand(self, t: Cursor,
+                     depth: Optional[int] = None,
+                     available_energy: float = 100,
+                     budget: Optional[Budget] = None) -> Expansion:
+        if depth is None:
+            depth = self.recommended_depth
+        history: List[Union[Layout, Generation]] = []
+        sizes = []
+        pruned = False
+        previous = None
+        for generation in self.generations(t, depth, available_energy, budget):
+            if previous is not None:
+                history.append(previous if previous.measured is None else previous.measured)
+            sizes.append(len(generation.commands))
+            pruned = pruned or generation.pruned
+            previous = generation
+        assert previous is not None
+
+        stopped = previous.depth < depth
+        if pruned and stopped:
+            outcome = BudgetOutcome.PRUNED_AND_STOPPED
+        elif pruned:
+            outcome = BudgetOutcome.PRUNED
+        elif stopped:
+            outcome = BudgetOutcome.STOPPED
+        else:
+            outcome = BudgetOutcome.COMPLETE
+        return Expansion(previous, history, sizes, depth, outcome)
+
+    def derive(self, t: Cursor,
+                     depth: Optional[int] = None,
+                     available_energy: float = 100,
+                     seed: int = 0) -> Derivation:
+        '''Like `expand`, but records which branch of each generation produced
+        which span of the next, what its rule saw and the random seed it
+        ran with. Randomness is reseeded per rule call from `seed`.'''
+        from .derivation import derive
+        return derive(self, t, depth, available_energy, seed)
+
+    def regenerate(self, previous: Derivation,
+                         affected: Optional[AffectedPredicate] = None,
+                         available_energy: Optional[float] = None) -> Derivation:
+        '''Re-derives `previous` with this system's rules (and possibly a new
+        energy budget), reusing every part of it that can't have changed.
+
+        A rule only re-runs if its branch is new, if a field of its snapshot
+        that it read last time has changed, or if `affected` (given the old
+        snapshot) says the rule change concerns it. Without `affected` every
+        rule re-runs, since any of them may have changed; pass
+        `rules_unchanged` if none did. When a re-run rule produces what it
+        did before, everything derived from it is kept too.'''
+        from .derivation import derive
+        if available_energy is None:
+            available_energy = previous.available_energy
+        return derive(
+            self,
+            Cursor.from_snapshot(previous.origin),
+            len(previous.steps),
+            available_energy,
+            previous.seed,
+            previous,
+            affected,
+        )
+
+    def generations(self, t: Cursor,
+                          depth: Optional[int] = None,
+                          available_energy: float = 100,
+                          budget: Optional[Budget] = None) -> Iterator[Generation]:
+        '''Yields the seed, then each generation as soon as it is complete.
+
+        With a budget, a generation that would exceed it is abandoned as
+        soon as it does. Depending on the policy, expansion then either ends
+        at the previous generation or retries with fewer rewrites.'''
         if depth is None:
             depth = self.recommended_depth
-        t.penup()
-        output = self.seed
+        prune = budget is not None and budget.policy == BudgetPolicy.PRUNE
+
+        # Each generation is walked on the grid its own angles call for,
+        # starting with the one rewriting it. That walk lays out the next
+        # generation, which is stamped with the same grid so that measuring
+        # it again from its origin agrees. Context-free generations aren't
+        # walked while rewriting, so they're stamped with their own grid.
+        start = t.snapshot()
+        output = as_rope(self.seed)
+        origin = self.place_on_grid(start, output)
+        # Context-free generations share nodes, and so do their extents
+        extents = RopeExtents() if self.context_free else None
+        if extents is not None:
+            yield Generation(0, output, origin, extent=extents.bounds(t, output))
+        else:
+            yield Generation(0, output, origin, measure(Cursor.from_snapshot(origin), output))
+        interned: IdentityMemo[Tuple[Command, ...], RopeLeaf] = IdentityMemo()
         for i in range(depth):
-            output = self._step_lsystem(t.clone(), output, available_energy)
-        return output
+            cursor = Cursor.from_snapshot(origin)
+            try:
+                new_output, layout = self._step(cursor, output, interned, available_energy, budget)
+                pruned = False
+            except BudgetExceeded as ex:
+                if not prune:
+                    return
+                assert budget is not None
+                pruned_step = self._pruned_step(cursor, output, interned, available_energy, budget, ex)
+                if pruned_step is None:
+                    return
+                new_output, layout = pruned_step
+                pruned = True
+            walked = origin
+            origin = self.place_on_grid(start, new_output)
+            extent = None if extents is None else extents.bounds(t, new_output)
+            yield Generation(i + 1, new_output, origin if layout is None else walked, layout, pruned, extent)
+            output = new_output
+
+    def _step(self, t: Cursor,
+                    commands: CommandRope,
+                    interned: IdentityMemo[Tuple[Command, ...], RopeLeaf],
+                    available_energy: float,
+                    budget: Optional[Budget] = None,
+                    min_energy: Optional[float] = None,
+                    ties: Optional[int] = None) -> Tuple[CommandRope, Optional[Layout]]:
+        # Only branches with at least `min_energy` are rewritten, and at most
+        # `ties` of those with exactly `min_energy` (if set). Context-free
+        # systems rewrite shared nodes, so they can't honor `ties`.
+        limit = None if budget is None else budget.command_limit(self.context_free)
+        if self.context_free:
+            assert ties is None
+            output = self._rewrite_lsystem(t, commands, interned, available_energy, min_energy)
+            if (limit is not None and len(output) > limit) or (budget is not None and not budget.holds(output)):
+                rewritten = sum(1 for cmd in commands if self._rewrites(cmd, min_energy))
+                raise BudgetExceeded(rewritten, len(output) - (len(commands) - rewritten))
+            return output, None
+        else:
+            tracker = BoundsTracker(t.pos())
+            output = self._step_lsystem(t.clone(), commands, available_energy, tracker, limit, min_energy, ties)
+            return output, tracker.finish()
+
+    def _pruned_step(self, t: Cursor,
+                           commands: CommandRope,
+                           interned: IdentityMemo[Tuple[Command, ...], RopeLeaf],
+                           available_energy: float,
+                           budget: Budget,
+                           overflow: BudgetExceeded) -> Optional[Tuple[CommandRope, Optional[Layout]]]:
+        # Estimate how many rewrites fit from the average growth per rewrite
+        # seen in the attempt that overflowed, then rewrite only that many of
+        # the highest-energy branches. If the estimate was too optimistic (or
+        # there's only a byte limit on a shared rope, and so nothing to
+        # estimate from), keep halving it until the generation fits or
+        # nothing is rewritten.
+        energies = sorted(
+            (cmd.energy for cmd in commands if isinstance(cmd, Branch) and self._rewrites(cmd)),
+            reverse=True,
+        )
+        growth = overflow.emitted / max(overflow.rewritten, 1) - 1
+        limit = budget.command_limit(self.context_free)
+        if limit is None or growth <= 0:
+            count = len(energies)
+        else:
+            count = min(len(energies), int((limit - len(commands)) / growth))
+        while count > 0:
+            threshold = energies[count - 1]
+            above = sum(1 for energy in energies if energy > threshold)
+            ties: Optional[int] = count - above
+            if self.context_free and count < len(energies) and energies[count] == threshold:
+                # Can't split ties, so only rewrite what's strictly above
+                if above == 0:
+                    return None
+                count = above
+                continue
+            elif self.context_free:
+                ties = None
+            try:
+                return self._step(t, commands, interned, available_energy, budget, threshold, ties)
+            except BudgetExceeded:
+                count //= 2
+        return None
+
+    def _rewrites(self, cmd: Command, min_energy: Optional[float] = None) -> bool:
+        return (isinstance(cmd, Branch)
+                and cmd.kind in self.rules
+                and (min_energy is None or cmd.energy >= min_energy))
 
-    def _step_lsystem(self, t: TurtleWrapper, commands: List[Command], available_energy: float = 100) -> List[Command]:
-        total_energy_used = sum(b.energy for b in commands if isinstance(b, Branch))
-        surplus = max(available_energy - total_energy_used, 0)
+    def _step_lsystem(self, t: Cursor,
+                      commands: CommandRope,
+                      available_energy: float = 100,
+                      tracker: Optional[BoundsTracker] = None,
+                      limit: Optional[int] = None,
+                      min_energy: Optional[float] = None,
+                      ties: Optional[int] = None) -> CommandRope:
+        surplus = max(available_energy - commands.energy, 0)
+        emitted = 0
+        rewritten = 0
+        rewritten_emitted = 0
 
-        def handler(_: TurtleSnapshot, branch: Branch) -> List[Command]:
-            if branch.kind in self.rules:
+        def handler(_: CursorSnapshot, branch: Branch) -> List[Command]:
+            nonlocal emitted, rewritten, rewritten_emitted, ties
+            rewrite = self._rewrites(branch, min_energy)
+            if rewrite and ties is not None and branch.energy == min_energy:
+                rewrite = ties > 0
+                ties -= 1
+            if rewrite:
                 snapshot = BranchSnapshot(branch, energy_surplus=surplus, pos=t.pos(), heading=t.heading())
-                return self.rules[branch.kind](snapshot)
+                out = self.rules[branch.kind](snapshot)
+                rewritten += 1
+                rewritten_emitted += len(out)
             else:
-                return [branch]
+                out = [branch]
+            emitted += len(out)
+            if limit is not None and emitted > limit:
+                raise BudgetExceeded(rewritten, rewritten_emitted)
+            return out
 
-        return interpret(t, commands, handler)
+        output = interpret(t, commands, handler, tracker)
+        if limit is not None and len(output) > limit:
+            raise BudgetExceeded(rewritten, rewritten_emitted)
+        return output
+
+    def _rewrite_lsystem(self, t: Cursor,
+                         commands: CommandRope,
+                         interned: IdentityMemo[Tuple[Command, ...], RopeLeaf],
+                         available_energy: float = 100,
+                         min_energy: Optional[float] = None) -> CommandRope:
+        # Rewrites the rope structurally, without a geometry pass
+        surplus = max(available_energy - commands.energy, 0)
+        pos, heading = t.pos(), t.heading()
+        branch_memo: IdentityMemo[Branch, CommandRope] = IdentityMemo()
+        node_memo: IdentityMemo[CommandRope, CommandRope] = IdentityMemo()
+        builder = RopeBuilder(interned)
+
+        def rewrite_branch(branch: Branch) -> CommandRope:
+            out = branch_memo.get(branch)
+            if out is None:
+                snapshot = BranchSnapshot(branch, energy_surplus=surplus, pos=pos, heading=heading)
+                out = branch_memo.put(branch, builder.leaf(self.rules[branch.kind](snapshot)))
+            return out
+
+        def rewrite(node: CommandRope) -> CommandRope:
+            memoized = node_memo.get(node)
+            if memoized is not None:
+                return memoized
+            if isinstance(node, RopeLeaf):
+                parts = RopeBuilder(interned)
+                for cmd in node.commands:
+                    if isinstance(cmd, Branch) and self._rewrites(cmd, min_energy):
+                        parts.extend_rope(rewrite_branch(cmd))
+                    else:
+                        parts.append(cmd)
+                out = parts.build()
+            else:
+                assert isinstance(node, RopeConcat)
+                out = concat([rewrite(part) for part in node.parts])
+            return node_memo.put(node, out)
 
+        return rewrite(commands)
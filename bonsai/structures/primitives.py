@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+from typing import List, Optional, Tuple, Union
+from dataclasses import dataclass
+import math
+
+from .branch import BranchKind, DEFAULT_KIND
+from .bounds import Bounds, Point
+
+# Red, green and blue, each from 0 to 1 (like turtle's colors)
+Color = Tuple[float, float, float]
+
+
+@dataclass(frozen=True)
+class Style:
+    stroke: Color = (0.0, 0.0, 0.0)
+    fill: Optional[Color] = None
+    width: float = 1
+
+
+@dataclass
+class Ellipse:
+    center: Point
+
+    # The semi-axes: along the rotated x axis, then across it
+    radii: Tuple[float, float]
+
+    # In degrees, counterclockwise from east
+    rotation: float = 0
+
+    kind: BranchKind = DEFAULT_KIND
+
+    def outline(self, points: int = 16) -> List[Point]:
+        '''Approximates the ellipse with a polygon, for backends that can't
+        draw rotated ellipses.'''
+        cx, cy = self.center
+        rx, ry = self.radii
+        radians = math.radians(self.rotation)
+        cos, sin = math.cos(radians), math.sin(radians)
+        result = []
+        for i in range(points):
+            theta = 2 * math.pi * i / points
+            x, y = rx * math.cos(theta), ry * math.sin(theta)
+            result.append((cx + x * cos - y * sin, cy + x * sin + y * cos))
+        return result
+
+    def bounds(self) -> Bounds:
+        bounds = Bounds()
+        radius = max(self.radii)
+        bounds.include((self.center[0] - radius, self.center[1] - radius))
+        bounds.include((self.center[0] + radius, self.center[1] + radius))
+        return bounds
+
+
+@dataclass
+class Polygon:
+    points: List[Point]
+    kind: BranchKind = DEFAULT_KIND
+
+    def outline(self, points: int = 16) -> List[Point]:
+        return self.points
+
+    def bounds(self) -> Bounds:
+        bounds = Bounds()
+        for point in self.points:
+            bounds.include(point)
+        return bounds
+
+
+Primitive = Union[Ellipse, Polygon]
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+from typing import Dict, Generic, Hashable, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, TypeVar, Union
+
+from .branch import Command, Branch, Push, Pop
+
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+
+class IdentityMemo(Generic[K, V]):
+    '''Values remembered by the identity of their key rather than its
+    equality, optionally along with something hashable (like the heading a
+    walk entered a node with). A tuple key stands for its items, each by
+    identity. Entries keep their key alive, so its ids can't be handed to
+    new objects while the memo holds them.'''
+
+    def __init__(self) -> None:
+        self._entries: Dict[Hashable, Tuple[K, V]] = {}
+
+    def get(self, key: K, extra: Hashable = None) -> Optional[V]:
+        entry = self._entries.get(self._identity(key, extra))
+        return None if entry is None else entry[1]
+
+    def put(self, key: K, value: V, extra: Hashable = None) -> V:
+        self._entries[self._identity(key, extra)] = (key, value)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _identity(key: K, extra: Hashable) -> Hashable:
+        if isinstance(key, tuple):
+            return (tuple(map(id, key)), extra)
+        return (id(key), extra)
+
+
+class CommandRope:
+    '''An immutable sequence of commands stored as a DAG.
+
+    A rope is either a leaf holding a run of commands or a concatenation
+    of other ropes. Nodes are never mutated once built, so the same node
+    can appear any number of times in one generation (or across several
+    generations) without being copied. The length and energy totals are
+    computed once when a node is built.'''
+
+    __slots__ = ('length', 'energy')
+
+    length: int
+    energy: float
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[Command]:
+        # Walk with an explicit stack: deep concatenations would otherwise
+        # pay for one nested generator per level, per command.
+        stack: List[CommandRope] = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, RopeLeaf):
+                yield from node.commands
+            else:
+                assert isinstance(node, RopeConcat)
+                stack.extend(reversed(node.parts))
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__} length={self.length} energy={self.energy}>"
+
+    def node_count(self) -> int:
+        '''The number of distinct nodes reachable from this rope.'''
+        return len(self._distinct_nodes())
+
+    def command_count(self) -> int:
+        '''The number of distinct commands held by the leaves of this rope.'''
+        seen: Set[int] = set()
+        for node in self._distinct_nodes():
+            if isinstance(node, RopeLeaf):
+                seen.update(id(cmd) for cmd in node.commands)
+        return len(seen)
+
+    def _distinct_nodes(self) -> List[CommandRope]:
+        seen: Set[int] = set()
+        nodes: List[CommandRope] = []
+        stack: List[CommandRope] = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            nodes.append(node)
+            if isinstance(node, RopeConcat):
+                stack.extend(node.parts)
+        return nodes
+
+
+class RopeLeaf(CommandRope):
+    __slots__ = ('commands',)
+
+    def __init__(self, commands: Sequence[Command]) -> None:
+        self.commands = tuple(commands)
+        self.length = len(self.commands)
+        self.energy = sum(cmd.energy for cmd in self.commands if isinstance(cmd, Branch))
+
+
+class RopeConcat(CommandRope):
+    __slots__ = ('parts',)
+
+    def __init__(self, parts: Sequence[CommandRope]) -> None:
+        self.parts = tuple(parts)
+        self.length = sum(part.length for part in self.parts)
+        self.energy = sum(part.energy for part in self.parts)
+
+
+EMPTY_ROPE: CommandRope = RopeLeaf(())
+
+
+def as_rope(commands: Union[CommandRope, Iterable[Command]]) -> CommandRope:
+    if isinstance(commands, CommandRope):
+        return commands
+    return RopeLeaf(list(commands))
+
+
+def concat(parts: Sequence[CommandRope]) -> CommandRope:
+    parts = [part for part in parts if part.length > 0]
+    if len(parts) == 0:
+        return EMPTY_ROPE
+    if len(parts) == 1:
+        return parts[0]
+    return RopeConcat(parts)
+
+
+class RopeBuilder:
+    '''Accumulates commands into a rope.
+
+    Single commands are gathered into runs; longer lists (typically the
+    output of a rule) become leaves of their own. Leaves are interned by
+    the identity of the commands they hold, so a rule that keeps returning
+    the same command objects (like most of the traditional systems) ends
+    up sharing a single leaf.'''
+
+    def __init__(self, interned: Optional[IdentityMemo[Tuple[Command, ...], RopeLeaf]] = None) -> None:
+        self.parts: List[CommandRope] = []
+        self.run: List[Command] = []
+        self.interned: IdentityMemo[Tuple[Command, ...], RopeLeaf] = IdentityMemo() if interned is None else interned
+
+    def append(self, cmd: Command) -> None:
+        self.run.append(cmd)
+
+    def extend(self, commands: Sequence[Command]) -> None:
+        if len(commands) <= 1:
+            self.run.extend(commands)
+        else:
+            self._flush()
+            self.parts.append(self.leaf(commands))
+
+    def extend_rope(self, rope: CommandRope) -> None:
+        self._flush()
+        self.parts.append(rope)
+
+    def leaf(self, commands: Sequence[Command]) -> RopeLeaf:
+        leaf = self.interned.get(tuple(commands))
+        if leaf is None:
+            leaf = RopeLeaf(commands)
+            self.interned.put(leaf.commands, leaf)
+        return leaf
+
+    def build(self) -> CommandRope:
+        self._flush()
+        return concat(self.parts)
+
+    def _flush(self) -> None:
+        if self.run:
+            self.parts.append(RopeLeaf(self.run))
+            self.run = []
+
+
+class BracketDepths:
+    '''The bracket depth at the end of each rope node, and the lowest it
+    gets along the way, both relative to the node's start. Walks that
+    memoize per node use this to tell which nodes they can treat as a
+    unit: a balanced node never pops a bracket it didn't push.'''
+
+    def __init__(self) -> None:
+        self._depths: IdentityMemo[CommandRope, Tuple[int, int]] = IdentityMemo()
+
+    def balanced(self, node: CommandRope) -> bool:
+        depth, lowest = self.depths(node)
+        return depth == 0 and lowest == 0
+
+    def depths(self, node: CommandRope) -> Tuple[int, int]:
+        entry = self._depths.get(node)
+        if entry is None:
+            depth = lowest = 0
+            if isinstance(node, RopeLeaf):
+                for cmd in node.commands:
+                    if isinstance(cmd, Push):
+                        depth += 1
+                    elif isinstance(cmd, Pop):
+                        depth -= 1
+                        lowest = min(lowest, depth)
+            else:
+                assert isinstance(node, RopeConcat)
+                for part in node.parts:
+                    part_depth, part_lowest = self.depths(part)
+                    lowest = min(lowest, depth + part_lowest)
+                    depth += part_depth
+            entry = self._depths.put(node, (depth, lowest))
+        return entry
@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from dataclasses import dataclass, field
+import math
+
+from .branch import Command, Branch, BranchKind, Push, Pop
+from .bounds import Bounds, Point
+from .cursor import Cursor
+from .grid import AngleGrid, GridCursor
+from .interpreter import Segment
+from .lsystem import BranchRenderer, LSystem
+from .primitives import Ellipse, Polygon, Primitive, Style
+from .rope import BracketDepths, CommandRope, IdentityMemo, RopeLeaf, RopeConcat, as_rope
+
+
+# A 2D affine matrix in SVG's order: (a, b, c, d, e, f) maps (x, y) to
+# (a * x + c * y + e, b * x + d * y + f)
+Matrix = Tuple[float, float, float, float, float, float]
+
+
+@dataclass(frozen=True)
+class Transform:
+    '''Scales, then rotates (in degrees, counterclockwise), then translates.'''
+    x: float = 0
+    y: float = 0
+    rotation: float = 0
+    scale: float = 1
+
+    def matrix(self) -> Matrix:
+        radians = math.radians(self.rotation)
+        cos, sin = self.scale * math.cos(radians), self.scale * math.sin(radians)
+        return (cos, sin, -sin, cos, self.x, self.y)
+
+    def apply(self, pos: Point) -> Point:
+        a, b, c, d, e, f = self.matrix()
+        x, y = pos
+        return (a * x + c * y + e, b * x + d * y + f)
+
+    def compose(self, inner: Transform) -> Transform:
+        '''The transform that applies `inner` first, then this one.'''
+        x, y = self.apply((inner.x, inner.y))
+        return Transform(x, y, self.rotation + inner.rotation, self.scale * inner.scale)
+
+    def transform_bounds(self, bounds: Bounds) -> Bounds:
+        # The box around the transformed corners, which may be a little
+        # looser than the box around the transformed geometry
+        result = Bounds()
+        if not bounds.empty:
+            for corner in [(bounds.min_x, bounds.min_y), (bounds.min_x, bounds.max_y),
+                           (bounds.max_x, bounds.min_y), (bounds.max_x, bounds.max_y)]:
+                result.include(self.apply(corner))
+        return result
+
+    def transform_primitive(self, primitive: Primitive) -> Primitive:
+        if isinstance(primitive, Ellipse):
+            rx, ry = primitive.radii
+            return Ellipse(self.apply(primitive.center), (rx * self.scale, ry * self.scale),
+                           primitive.rotation + self.rotation, primitive.kind)
+        return Polygon([self.apply(point) for point in primitive.points], primitive.kind)
+
+
+@dataclass
+class Instance:
+    prototype: int
+    transform: Transform
+
+
+@dataclass
+class Prototype:
+    '''Geometry that's stored (and emitted) once however often it appears.
+
+    It's expressed in its own frame, as if drawn by a cursor starting at
+    the origin and heading east. Nested prototypes are placed relative to
+    that frame rather than copied into `segments`. `primitives` holds what
+    the render rules drew in the same frame, and `styles` the style of
+    every kind of stroke or shape drawn.'''
+    key: int
+    segments: List[Segment] = field(default_factory=list)
+    primitives: List[Primitive] = field(default_factory=list)
+    styles: Dict[BranchKind, Style] = field(default_factory=dict)
+    instances: List[Instance] = field(default_factory=list)
+    bounds: Bounds = field(default_factory=Bounds)
+
+    # How many commands this prototype stands for, nested prototypes included
+    size: int = 0
+
+    # How many times it appears in the whole scene
+    uses: int = 0
+
+    # Where drawing it leaves the cursor, in its own frame. Only matters
+    # for a run of commands: a bracketed subtree puts the cursor back.
+    end: Transform = field(default_factory=Transform)
+
+
+# An interned node: either a branch, or a sequence of other node keys
+Node = Union[Branch, Tuple[int, ...]]
+
+
+class _Look:
+    '''How the branches of a tree are drawn: the render rules and styles
+    of the lsystem it came from.'''
+
+    def __init__(self, key: int,
+                       render_rules: Dict[BranchKind, BranchRenderer],
+                       styles: Dict[BranchKind, Style]) -> None:
+        self.key = key
+        self.render_rules = render_rules
+        self.styles = styles
+
+    def style(self, kind: BranchKind) -> Style:
+        return self.styles.get(kind, Style())
+
+
+LookKey = Tuple[FrozenSet[Tuple[BranchKind, BranchRenderer]], FrozenSet[Tuple[BranchKind, Style]]]
+
+
+class Scene:
+    '''Many trees, each placed with its own transform.
+
+    Every command stream added is hash-consed: branches, bracketed
+    subtrees and the nodes of a rope are interned by their structure, so
+    identical ones (within a tree or across trees) get the same key. A
+    rope node is interned once however often it appears, so adding a
+    context-free expansion costs as much as its distinct nodes rather
+    than its length. Trees that are identical share one prototype, and so
+    does every subtree or rope node of at least `min_instance_size`
+    commands that appears more than once; the others are inlined into
+    their parent. What's stored, and what an instancing
+    exporter emits, grows with the amount of unique structure rather than
+    with the number of trees.
+
+    Branches are drawn with the render rules and styles they were added
+    with, so trees that look different never share a prototype. A render
+    rule is handed whichever of the equal branches was interned first, so
+    it should depend on nothing but the cursor and the branch's angle,
+    length and kind.'''
+
+    def __init__(self, min_instance_size: int = 16) -> None:
+        self.min_instance_size = min_instance_size
+        self.instances: List[Instance] = []
+
+        self._looks: Dict[LookKey, _Look] = {}
+        self._branch_looks: Dict[int, _Look] = {}
+        self._keys: Dict[Tuple[float, float, BranchKind, int], int] = {}
+        self._sequences: Dict[Tuple[bool, Tuple[int, ...]], int] = {}
+        self._nodes: List[Node] = []
+        self._sizes: List[int] = []
+
+        # Whether drawing a node puts the cursor back where it started
+        self._bracketed: List[bool] = []
+
+        # Rope nodes and expansions seen before
+        self._depths = BracketDepths()
+        self._rope_nodes: IdentityMemo[CommandRope, int] = IdentityMemo()
+        self._expansions: IdentityMemo[LSystem, int] = IdentityMemo()
+
+        self._prototypes: Optional[Dict[int, Prototype]] = None
+
+    def add(self, commands: Iterable[Command],
+                  at: Point = (0, 0),
+                  heading: float = 90,
+                  scale: float = 1,
+                  render_rules: Optional[Dict[BranchKind, BranchRenderer]] = None,
+                  styles: Optional[Dict[BranchKind, Style]] = None) -> Instance:
+        '''Places a tree whose first branch starts at `at`, facing `heading`.'''
+        look = self._look({} if render_rules is None else render_rules, {} if styles is None else styles)
+        return self._place(self._intern_rope(as_rope(commands), look), Transform(at[0], at[1], heading, scale))
+
+    def place(self, lsystem: LSystem,
+                    at: Point = (0, 0),
+                    heading: float = 90,
+                    scale: float = 1,
+                    depth: Optional[int] = None,
+                    available_energy: float = 100) -> Instance:
+        '''Expands the lsystem and places the result. A context-free system
+        always expands the same way, so it's only expanded (and hashed) the
+        first time it's placed with a given depth and energy.'''
+        key = self._expansions.get(lsystem, (depth, available_energy)) if lsystem.context_free else None
+        if key is not None:
+            return self._place(key, Transform(at[0], at[1], heading, scale))
+        expansion = lsystem.expand(Cursor(at[0], at[1], heading), depth, available_energy)
+        instance = self.add(expansion.commands, at, heading, scale, lsystem.render_rules, lsystem.styles)
+        if lsystem.context_free:
+            self._expansions.put(lsystem, instance.prototype, (depth, available_energy))
+        return instance
+
+    def prototypes(self) -> Dict[int, Prototype]:
+        '''Every prototype in the scene, each one after those it places.'''
+        if self._prototypes is None:
+            self._prototypes = self._build_prototypes()
+        return self._prototypes
+
+    def bounds(self) -> Bounds:
+        prototypes = self.prototypes()
+        bounds = Bounds()
+        for instance in self.instances:
+            bounds.extend(instance.transform.transform_bounds(prototypes[instance.prototype].bounds))
+        return bounds
+
+    def placements(self) -> Dict[int, List[Transform]]:
+        '''Where each prototype ends up in the scene, with nested placements
+        composed: the flat form GPU-style instancing wants.'''
+        prototypes = self.prototypes()
+        placements: Dict[int, List[Transform]] = {key: [] for key in prototypes}
+        for instance in self.instances:
+            placements[instance.prototype].append(instance.transform)
+        # Parents come after their children, so walk backwards to visit
+        # every parent's placements before pushing them down
+        for key in reversed(list(prototypes)):
+            for nested in prototypes[key].instances:
+                placements[nested.prototype].extend(
+                    transform.compose(nested.transform) for transform in placements[key]
+                )
+        return placements
+
+    def segments(self) -> Iterator[Segment]:
+        '''Every line in the scene, in scene coordinates, for consumers that
+        can't instance.'''
+        prototypes = self.prototypes()
+        for key, transforms in self.placements().items():
+            for transform in transforms:
+                for segment in prototypes[key].segments:
+                    yield Segment(transform.apply(segment.start), transform.apply(segment.end), segment.branch)
+
+    def primitives(self) -> Iterator[Primitive]:
+        '''Every shape the render rules drew, in scene coordinates.'''
+        prototypes = self.prototypes()
+        for key, transforms in self.placements().items():
+            for transform in transforms:
+                for primitive in prototypes[key].primitives:
+                    yield transform.transform_primitive(primitive)
+
+    def _look(self, render_rules: Dict[BranchKind, BranchRenderer], styles: Dict[BranchKind, Style]) -> _Look:
+        look_key = (frozenset(render_rules.items()), frozenset(styles.items()))
+        look = self._looks.get(look_key)
+        if look is None:
+            look = _Look(len(self._looks), dict(render_rules), dict(styles))
+            self._looks[look_key] = look
+        return look
+
+    def _place(self, key: int, transform: Transform) -> Instance:
+        instance = Instance(key, transform)
+        self.instances.append(instance)
+        self._prototypes = None
+        return instance
+
+    def _intern(self, node: Node, size: int, bracketed: bool = False) -> int:
+        self._nodes.append(node)
+        self._sizes.append(size)
+        self._bracketed.append(bracketed)
+        return len(self._nodes) - 1
+
+    def _intern_rope(self, rope: CommandRope, look: _Look) -> int:
+        # Children are always interned before the sequences holding them,
+        # so a node's key is larger than the keys of everything inside it
+        open_sequences: List[List[int]] = [[]]
+        self._visit(rope, open_sequences, look)
+
+        # Unbalanced pushes don't change anything that gets drawn
+        while len(open_sequences) > 1:
+            items = open_sequences.pop()
+            open_sequences[-1].append(self._intern_sequence(items, 1))
+        return self._intern_sequence(open_sequences[0], 0)
+
+    def _visit(self, node: CommandRope, open_sequences: List[List[int]], look: _Look) -> None:
+        # A balanced node interns the same way whatever brackets are open
+        # around it, so it's interned once and then found by identity.
+        # Any other node closes or leaves open brackets of its context, so
+        # it's walked part by part in place, down to the commands of its
+        # leaves.
+        if self._depths.balanced(node):
+            open_sequences[-1].append(self._intern_node(node, look))
+        elif isinstance(node, RopeLeaf):
+            self._intern_commands(node.commands, open_sequences, look)
+        else:
+            assert isinstance(node, RopeConcat)
+            for part in node.parts:
+                self._visit(part, open_sequences, look)
+
+    def _intern_node(self, node: CommandRope, look: _Look) -> int:
+        key = self._rope_nodes.get(node, look.key)
+        if key is None:
+            open_sequences: List[List[int]] = [[]]
+            if isinstance(node, RopeLeaf):
+                self._intern_commands(node.commands, open_sequences, look)
+            else:
+                assert isinstance(node, RopeConcat)
+                for part in node.parts:
+                    self._visit(part, open_sequences, look)
+            items = open_sequences[0]
+            # A node holding a single item is that item
+            key = items[0] if len(items) == 1 else self._intern_sequence(items, 0)
+            self._rope_nodes.put(node, key, look.key)
+        return key
+
+    def _intern_commands(self, commands: Iterable[Command], open_sequences: List[List[int]], look: _Look) -> None:
+        for cmd in commands:
+            if isinstance(cmd, Push):
+                open_sequences.append([])
+            elif isinstance(cmd, Pop):
+                if len(open_sequences) == 1:
+                    raise Exception(f"Unbalanced command: {cmd}", cmd)
+                items = open_sequences.pop()
+                open_sequences[-1].append(self._intern_sequence(items, 2))
+            elif isinstance(cmd, Branch):
+                branch_key = (cmd.angle, cmd.length, cmd.kind, look.key)
+                key = self._keys.get(branch_key)
+                if key is None:
+                    key = self._intern(cmd, 1)
+                    self._keys[branch_key] = key
+                    self._branch_looks[key] = look
+                open_sequences[-1].append(key)
+            else:
+                raise Exception(f"Unrecognized command: {cmd}", cmd)
+
+    def _intern_sequence(self, items: List[int], brackets: int) -> int:
+        # Bracketed and unbracketed sequences of the same items draw
+        # differently, so they're told apart
+        items_key = (brackets > 0, tuple(items))
+        key = self._sequences.get(items_key)
+        if key is None:
+            key = self._intern(items_key[1], brackets + sum(self._sizes[item] for item in items), brackets > 0)
+            self._sequences[items_key] = key
+        return key
+
+    def _build_prototypes(self) -> Dict[int, Prototype]:
+        uses: Dict[int, int] = {}
+        for instance in self.instances:
+            uses[instance.prototype] = uses.get(instance.prototype, 0) + 1
+        for key in range(max(uses, default=-1), -1, -1):
+            node = self._nodes[key]
+            if key in uses and isinstance(node, tuple):
+                for item in node:
+                    uses[item] = uses.get(item, 0) + uses[key]
+
+        roots = {instance.prototype for instance in self.instances}
+        shared = roots | {
+            key for key, count in uses.items()
+            if count > 1 and isinstance(self._nodes[key], tuple) and self._sizes[key] >= self.min_instance_size
+        }
+
+        # With commensurate angles, every prototype is drawn on the same
+        # angle grid, so positions that should coincide do exactly
+        grid = AngleGrid.for_angles({angle for angle, _, _, _ in self._keys})
+        prototypes: Dict[int, Prototype] = {}
+        for key in sorted(shared):
+            prototype = Prototype(key, size=self._sizes[key], uses=uses[key])
+            cursor = Cursor() if grid is None else GridCursor(grid)
+            self._draw(key, cursor, prototype, shared, prototypes)
+            prototype.end = Transform(cursor.x, cursor.y, cursor.angle)
+            prototype.bounds.include((0, 0))
+            for instance in prototype.instances:
+                prototype.bounds.extend(instance.transform.transform_bounds(prototypes[instance.prototype].bounds))
+            prototypes[key] = prototype
+        return prototypes
+
+    def _draw(self, key: int,
+                    cursor: Cursor,
+                    prototype: Prototype,
+                    shared: Set[int],
+                    prototypes: Dict[int, Prototype]) -> None:
+        node = self._nodes[key]
+        assert isinstance(node, tuple)
+        for item in node:
+            child = self._nodes[item]
+            if isinstance(child, Branch):
+                look = self._branch_looks[item]
+                if child.kind in look.render_rules:
+                    for primitive in look.render_rules[child.kind](cursor.snapshot(), child):
+                        prototype.primitives.append(primitive)
+                        prototype.styles.setdefault(primitive.kind, look.style(primitive.kind))
+                        prototype.bounds.extend(primitive.bounds())
+                cursor.left(child.angle)
+                if child.length != 0:
+                    start = cursor.pos()
+                    cursor.forward(child.length)
+                    prototype.segments.append(Segment(start, cursor.pos(), child))
+                    prototype.styles.setdefault(child.kind, look.style(child.kind))
+                    prototype.bounds.include(start)
+                    prototype.bounds.include(cursor.pos())
+            elif item in shared:
+                placement = Transform(cursor.x, cursor.y, cursor.angle)
+                prototype.instances.append(Instance(item, placement))
+                if not self._bracketed[item]:
+                    # Carry on from wherever the instance leaves off
+                    end = prototypes[item].end
+                    cursor.x, cursor.y = placement.apply((end.x, end.y))
+                    cursor.left(end.rotation)
+            elif self._bracketed[item]:
+                saved = cursor.clone()
+                self._draw(item, cursor, prototype, shared, prototypes)
+                cursor.x, cursor.y, cursor.angle = saved.x, saved.y, saved.angle
+            else:
+                self._draw(item, cursor, prototype, shared, prototypes)
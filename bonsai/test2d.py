@@ -1,13 +1,11 @@
 from __future__ import annotations
 
-from typing import List
+from typing import Iterable, List
 
-from bonsai.structures import Command, Branch, interpret
+from bonsai.structures import Command, CommandRope, Branch, Cursor, CursorSnapshot, interpret
 from bonsai.math_utils import sigmoid
-from bonsai.turtle_wrapper import TurtleWrapper, TurtleSnapshot
 import bonsai.lsystems.traditional as traditional
 import bonsai.lsystems.organic as organic
-import bonsai.render_2d as render_2d
 
 def interpolate_headings(h1: float, h2: float, a: float, b: float) -> float:
     bigger = h1 
@@ -29,10 +27,10 @@ def interpolate_headings(h1: float, h2: float, a: float, b: float) -> float:
     return out
 
 
-def apply_force(t: TurtleWrapper, commands: List[Command],
-                global_heading: float, force: float) -> List[Command]:
+def apply_force(t: Cursor, commands: Iterable[Command],
+                global_heading: float, force: float) -> CommandRope:
 
-    def handler(t: TurtleSnapshot, branch: Branch) -> List[Command]:
+    def handler(t: CursorSnapshot, branch: Branch) -> List[Command]:
         new_heading = interpolate_headings(
             t.heading + branch.angle,
             global_heading,
@@ -46,18 +44,16 @@ def apply_force(t: TurtleWrapper, commands: List[Command],
 
 
 def main() -> None:
+    # Imported here so that the rest of this module works without Tk
     import turtle
+    import bonsai.render_2d as render_2d
+    from bonsai.turtle_wrapper import TurtleWrapper
+
     turtle.tracer(0)
     t = TurtleWrapper(0, -250, 90)
 
-    print("Fetching lsystem rules...")
-    lsystem = organic.weed_plant()
-
-    print("Generating...")
-    commands = lsystem.expand(t.clone(), available_energy=1000)
-
-    print(f"Finished generating. Produced final instruction list of length {len(commands)}; now rendering...")
-    render_2d.draw_and_wait(t.clone(), commands, render_rules=lsystem.render_rules)
+    print("Generating and rendering; click the window to regenerate...")
+    render_2d.draw_progressively(t, organic.weed_plant, available_energy=1000)
 
 
 if __name__ == '__main__':
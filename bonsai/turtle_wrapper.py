@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from typing import Iterator, Tuple, Dict, cast
+from typing import Iterator, Dict, cast
 
 import turtle
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+from bonsai.structures.cursor import CursorSnapshot
 
 
 PenState = Dict[str, object]
@@ -52,11 +54,12 @@ class TurtleWrapper(turtle.Turtle):
             pen=self.pen(),
         )
 
-    def restore(self, snapshot: TurtleSnapshot) -> None:
+    def restore(self, snapshot: CursorSnapshot) -> None:
         with self.no_draw():
             self.setposition(snapshot.pos)
             self.setheading(snapshot.heading)
-            self.pen(snapshot.pen)
+            if isinstance(snapshot, TurtleSnapshot):
+                self.pen(snapshot.pen)
 
     def reset(self) -> None:
         super().reset()
@@ -64,7 +67,5 @@ class TurtleWrapper(turtle.Turtle):
 
 
 @dataclass
-class TurtleSnapshot:
-    pos: Tuple[float, float]
-    heading: float
-    pen: PenState
+class TurtleSnapshot(CursorSnapshot):
+    pen: PenState = field(default_factory=dict)